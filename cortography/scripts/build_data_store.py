@@ -0,0 +1,11 @@
+import sys
+
+from cortography.utils import store_utils
+
+#### Consolidate ../data/ into the memory-mappable .npy store (+ manifest.json)
+#### Optional argument: output directory (defaults to cortography/data/store/)
+store_dir = sys.argv[1] if len(sys.argv) > 1 else None
+manifest = store_utils.build_store(store_dir)
+
+for name, array in manifest['arrays'].items():
+    print(name, array['shape'], array['dtype'])
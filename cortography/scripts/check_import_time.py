@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+#### Import-time regression check for the data-only path.
+#### Fails if importing a data module pulls in plotting/imaging dependencies,
+#### or takes longer than the budget (seconds, optional first argument).
+#### Every cortography/utils/*_utils.py module is checked, so modules added
+#### later are covered without editing this script.
+utils_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils')
+data_modules = sorted(
+    'cortography.utils.' + filename[:-len('.py')]
+    for filename in os.listdir(utils_dir)
+    if filename.endswith('_utils.py')
+)
+lazy_dependencies = ['matplotlib', 'nilearn', 'nibabel']
+budget = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+
+failed = False
+for module in data_modules:
+    # `python -X importtime` reports "import time: self [us] | cumulative | name"
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        capture_output=True, text=True, check=True,
+    )
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, total, name = line[len('import time:'):].split('|')
+        cumulative[name.strip()] = int(total)
+
+    loaded = sorted({name.split('.')[0] for name in cumulative} & set(lazy_dependencies))
+    seconds = cumulative[module] / 1e6
+    print('{}: {:.3f}s {}'.format(module, seconds, ' '.join(loaded)))
+
+    if loaded or seconds > budget:
+        failed = True
+
+sys.exit(1 if failed else 0)
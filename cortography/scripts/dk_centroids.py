@@ -0,0 +1,17 @@
+from atlasreader import atlasreader
+from cortography.utils import volume_utils
+
+#### DK template from atlasreader:
+DK_atlas = atlasreader.get_atlas('desikan_killiany')
+DK_labels = {
+    index: name
+    for index, name in zip(DK_atlas['labels']['index'], DK_atlas['labels']['name'])
+    if name != 'Unknown'
+}
+
+#### centers of mass (MNI) of every DK region, in one pass over the volume:
+DK_centroids = volume_utils.region_centroids(DK_atlas['image'], labels=DK_labels)
+DK_centroids.index.name = 'Name'
+
+# save to file (read back by volume_utils.load_centroids)
+DK_centroids.round(4).to_csv('../data/atlases/DK/dk_centroids.csv')
@@ -1,8 +1,12 @@
 import pandas as pd
 import os
+from functools import lru_cache
 from scipy.io import loadmat
 import numpy as np
-from nilearn import plotting
+from cortography.utils import store_utils
+
+# nibabel and nilearn are imported where they are used, so that loading atlas
+# data (e.g. in CLI tools or Pool workers) stays cheap.
 
 
 def get_file_path(filename):
@@ -21,78 +25,339 @@ def get_file_path(filename):
     return file_dir
 
 
+CACHE_SIZE = 32
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _read_csv(filename):
+    """Parse a csv file from ./data/ once per process."""
+    return pd.read_csv(get_file_path(filename))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _read_mat(filename):
+    """Parse a .mat file from ./data/ once per process (used when the
+    memory-mapped store of `store_utils.build_store` has not been built).
+
+    The arrays are flagged read-only, since they are shared by every caller.
+
+    """
+    mat = loadmat(get_file_path(filename))
+    for value in mat.values():
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+    return mat
+
+
+# (Cortex, Hemisphere) blocks, in order, making up each DK region ordering
+PORTIONS = {
+    "LR": [("cortical", "Left"), ("cortical", "Right")],
+    "RL": [("cortical", "Right"), ("cortical", "Left")],
+    "LRLR": [
+        ("cortical", "Left"),
+        ("cortical", "Right"),
+        ("subcortical", "Left"),
+        ("subcortical", "Right"),
+    ],
+    "LRRL": [
+        ("cortical", "Left"),
+        ("cortical", "Right"),
+        ("subcortical", "Right"),
+        ("subcortical", "Left"),
+    ],
+    "RLLR": [
+        ("cortical", "Right"),
+        ("cortical", "Left"),
+        ("subcortical", "Left"),
+        ("subcortical", "Right"),
+    ],
+}
+
+# DK regions absent from the bundled 86 x 86 connectomes and Laplacians
+CONNECTOME_EXCLUDED = [
+    "Left-VentralDC",
+    "Left-choroid-plexus",
+    "Right-VentralDC",
+    "Right-choroid-plexus",
+]
+
+
 def load_atlas(atlas="DK", portion="all"):
     """Load atlas data and returns it as a pandas dataframe.
 
+    Results are memoized; each call returns a fresh copy.
+
     Args:
         atlas (str): Atlas name: "DK" or "AAL".
-        portion (str): Options are: "LR", "RL", "LRLR", "LRRL".
+        portion (str): Options are: "all", "LR", "RL", "LRLR", "LRRL", "RLLR".
 
     Returns:
         atlas (pd.DataFrame): Database with atlas information.
 
     """
+    return _load_atlas(atlas, portion).copy()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _load_atlas(atlas, portion):
     if atlas == "DK":
-        filepath = get_file_path("atlases/DK/dk_all.csv")
-        dk = pd.read_csv(filepath)
+        dk = _read_csv("atlases/DK/dk_all.csv")
+    else:
+        raise NameError("Atlas option not found.")
 
-        if portion == "all":
-            indices = dk.index
+    return dk.iloc[_portion_rows(portion)].set_index("Name")
 
-        else:
 
-            cortical_df = dk[dk["Cortex"] == "cortical"]
-            subcortical_df = dk[dk["Cortex"] == "subcortical"]
+@lru_cache(maxsize=CACHE_SIZE)
+def _portion_rows(portion):
+    """Row positions of dk_all.csv making up a DK `portion` ordering."""
+    dk = _read_csv("atlases/DK/dk_all.csv")
 
-            cort_L_idx = cortical_df[cortical_df["Hemisphere"] == "Left"].index
-            cort_R_idx = cortical_df[cortical_df["Hemisphere"] == "Right"].index
+    if portion == "all":
+        rows = np.arange(len(dk))
+    elif portion in PORTIONS:
+        rows = np.concatenate(
+            [
+                np.flatnonzero((dk["Cortex"] == cortex) & (dk["Hemisphere"] == hemi))
+                for cortex, hemi in PORTIONS[portion]
+            ]
+        )
+    else:
+        raise NameError("Portion option not found.")
 
-            subcort_L_idx = subcortical_df[subcortical_df["Hemisphere"] == "Left"].index
-            subcort_R_idx = subcortical_df[
-                subcortical_df["Hemisphere"] == "Right"
-            ].index
+    rows.flags.writeable = False
+    return rows
 
-            if portion == "LR":
-                indices = list(cort_L_idx) + list(cort_R_idx)
 
-            elif portion == "RL":
-                indices = list(cort_R_idx) + list(cort_L_idx)
+@lru_cache(maxsize=CACHE_SIZE)
+def reorder_indices(source, target, connectome=True):
+    """Integer permutation taking DK data in `source` order to `target` order.
 
-            elif portion == "LRLR":
-                indices = list(cort_L_idx) + list(cort_R_idx)
-                indices += list(subcort_L_idx) + list(subcort_R_idx)
+    `data[reorder_indices(source, target)]` is `data` in the `target`
+    ordering. Indices are built once per pair and cached (read-only).
 
-            elif portion == "LRRL":
-                indices = list(cort_L_idx) + list(cort_R_idx)
-                indices += list(subcort_R_idx) + list(subcort_L_idx)
+    Args:
+        source (str): ordering of the data: "all", "LR", "RL", "LRLR", "LRRL"
+            or "RLLR".
+        target (str): desired ordering, same options as `source`.
+        connectome (bool): if True, regions listed in CONNECTOME_EXCLUDED are
+            left out of both orderings, as in the bundled 86 x 86 matrices.
+
+    Returns:
+        np.ndarray: positions into the `source` axis, in `target` order.
+
+    """
+    source_names = _portion_names(source, connectome)
+    target_names = _portion_names(target, connectome)
+
+    indices = source_names.get_indexer(target_names)
+    if (indices < 0).any():
+        raise ValueError(
+            "Ordering " + target + " has regions missing from ordering " + source
+        )
+
+    indices.flags.writeable = False
+    return indices
+
+
+def _portion_names(portion, connectome):
+    names = _read_csv("atlases/DK/dk_all.csv")["Name"]
+    names = pd.Index(names.values[_portion_rows(portion)])
+    if connectome:
+        names = names.drop(CONNECTOME_EXCLUDED, errors="ignore")
+    return names
 
-            elif portion == "RLLR":
-                indices = list(cort_R_idx) + list(cort_L_idx)
-                indices += list(subcort_L_idx) + list(subcort_R_idx)
-    else:
-        raise NameError("Atlas option not found.")
 
-    return dk.loc[indices].set_index("Name")
+def reorder(data, source, target, axis=(-2, -1), connectome=True):
+    """Reorder DK region axes of an array without a DataFrame round-trip.
+
+    Works on a single (R, R) matrix, a stacked (N, R, R) cohort or, with
+    `axis=-1`, a (subjects x regions) table. Matrices are reordered with one
+    fancy-indexing gather over the whole stack.
+
+    Args:
+        data (np.ndarray): array with regions in `source` order along `axis`.
+        source (str): current ordering (see `reorder_indices`).
+        target (str): desired ordering.
+        axis (int or tuple): region axes. Defaults to the last two.
+        connectome (bool): see `reorder_indices`.
+
+    Returns:
+        np.ndarray: reordered copy of `data`.
+
+    """
+    indices = reorder_indices(source, target, connectome)
+    data = np.asarray(data)
+
+    if np.ndim(axis) == 0:
+        return np.take(data, indices, axis=axis)
+    if tuple(axis) == (-2, -1) or tuple(axis) == (data.ndim - 2, data.ndim - 1):
+        return data[..., indices[:, None], indices]
+    for ax in axis:
+        data = np.take(data, indices, axis=ax)
+    return data
+
+
+# dk_all.csv columns holding region names, one naming convention each
+DK_NAME_COLUMNS = [
+    "Name",
+    "Short Name",
+    "Other Name",
+    "Other Name 2",
+    "Other Name 3",
+    "Other Name 4",
+    "Other Name 5",
+]
+
+# names other pipelines use for connectome regions (e.g. mean80_fibercount)
+CONNECTOME_ALIASES = {
+    "Left-VentralDC": "Left-VentralDC/Hypothalamus",
+    "Right-VentralDC": "Right-VentralDC/Hypothalamus",
+}
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _dk_alias_index(connectome):
+    """Hash index of every DK alias and the dk_all.csv row it stands for.
+
+    Aliases shared by several regions (e.g. "bankssts" of both hemispheres)
+    and placeholders ("-") are left out. With `connectome`, aliases of the
+    CONNECTOME_EXCLUDED regions point to their CONNECTOME_ALIASES region.
+
+    """
+    dk = _read_csv("atlases/DK/dk_all.csv")
+    aliases = dk[DK_NAME_COLUMNS].apply(lambda column: column.str.strip())
+    aliases = aliases.stack()
+    aliases = aliases[aliases != "-"]
+    rows = aliases.index.get_level_values(0).values
+
+    rows = pd.Series(rows, index=aliases.values)
+    rows = rows.groupby(level=0).agg(lambda rows: set(rows))
+    rows = rows[rows.map(len) == 1].map(min)
+
+    if connectome:
+        names = pd.Index(dk["Name"])
+        excluded = pd.Series(names.get_indexer(CONNECTOME_EXCLUDED))
+        targets = [CONNECTOME_ALIASES.get(name) for name in CONNECTOME_EXCLUDED]
+        redirect = {
+            row: names.get_loc(target)
+            for row, target in zip(excluded, targets)
+            if target is not None
+        }
+        rows = rows[~rows.isin(set(excluded) - set(redirect))].replace(redirect)
+
+    return pd.Index(rows.index), rows.values
+
+
+def dk_name_indices(names, connectome=True):
+    """dk_all.csv row of each DK region name, whatever its naming convention.
+
+    One hash lookup for all names, in any of the DK_NAME_COLUMNS
+    conventions (e.g. "ctx-lh-bankssts", "lBSTS", "Bankssts_L", ...).
+
+    Args:
+        names (list or array): region names.
+        connectome (bool): resolve the CONNECTOME_EXCLUDED regions to their
+            CONNECTOME_ALIASES region (e.g. "Left-VentralDC" ->
+            "Left-VentralDC/Hypothalamus") and ignore the others.
+
+    Returns:
+        np.ndarray: row positions in `load_atlas("DK")`, -1 for unmatched
+        (or ambiguous, e.g. "bankssts") names.
+
+    """
+    aliases, rows = _dk_alias_index(connectome)
+    names = pd.Index(names).astype(str).str.strip()
+    positions = aliases.get_indexer(names)
+    return np.where(positions >= 0, rows[positions], -1)
+
+
+def translate_dk_names(data, convention="Name", axis=None, connectome=True):
+    """Rename DK regions to one naming convention in a single vectorized call.
+
+    Args:
+        data (pd.DataFrame, pd.Series, list or np.ndarray): a table whose
+            index and/or columns are DK region names, or an array of names.
+        convention (str): target naming, one of DK_NAME_COLUMNS.
+        axis (str, optional): for DataFrames, "index", "columns" or None
+            for both.
+        connectome (bool): see `dk_name_indices`.
+
+    Returns:
+        translated: `data` with region names in `convention` (unmatched
+            names are left as they are).
+        unmatched (list): names that could not be resolved, or that have no
+            name in `convention` (a "-" or empty entry in dk_all.csv).
+
+    """
+    if convention not in DK_NAME_COLUMNS:
+        raise ValueError("Naming convention must be one of DK_NAME_COLUMNS.")
+    targets = _read_csv("atlases/DK/dk_all.csv")[convention].str.strip()
+    has_target = ~(targets.isna() | targets.isin(["", "-"])).values
+    targets = targets.values
+    unmatched = []
+
+    def translate(names):
+        names = pd.Index(names)
+        rows = dk_name_indices(names, connectome)
+        found = rows >= 0
+        found[found] = has_target[rows[found]]
+        unmatched.extend(names[~found])
+        return np.where(found, targets[rows], names.values.astype(object))
+
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        data = data.copy()
+        if axis in (None, "index"):
+            data.index = translate(data.index)
+        if axis in (None, "columns") and isinstance(data, pd.DataFrame):
+            data.columns = translate(data.columns)
+        return data, list(dict.fromkeys(unmatched))
+
+    names = np.asarray(data)
+    translated = translate(names.ravel()).reshape(names.shape)
+    return translated, list(dict.fromkeys(unmatched))
 
 
 def load_connectivity(atlas="DK", portion="RLLR"):
+    """Load the DK structural connectivity matrix.
+
+    The bundled matrix is stored in RLLR ordering; other portions are
+    reordered from it by region (see `reorder_indices`).
+
+    Results are memoized; each call returns a fresh copy.
+
+    Args:
+        atlas (str): Atlas name: "DK".
+        portion (str): ordering of the regions: "all", "LR", "RL", "LRLR",
+            "LRRL" or "RLLR" (CONNECTOME_EXCLUDED regions are left out).
+
+    Returns:
+        pd.DataFrame: (86 x 86) connectivity labeled by region name.
+
+    """
+    return _load_connectivity(atlas, portion).copy()
+
 
+@lru_cache(maxsize=CACHE_SIZE)
+def _load_connectivity(atlas, portion):
     if atlas == "DK":
-        conn_filepath = get_file_path("connectivity_matrices/dk_connectivity.mat")
-        connectivity = pd.DataFrame(loadmat(conn_filepath)["meanACS"])
-        atlas = load_atlas(atlas="DK", portion=portion)
-        regions_to_drop = [
-            "Left-VentralDC",
-            "Left-choroid-plexus",
-            "Right-VentralDC",
-            "Right-choroid-plexus",
-        ]
-        atlas = load_atlas("DK", "RLLR").drop(regions_to_drop)
+        if store_utils.has_array("dk_connectivity"):
+            connectivity = store_utils.load_array("dk_connectivity")
+        else:
+            mat = _read_mat("connectivity_matrices/dk_connectivity.mat")
+            connectivity = mat["meanACS"]
+        # no copy: a store memmap stays shared (read-only) with other processes
+        connectivity = pd.DataFrame(connectivity, copy=False)
+        atlas = _load_atlas("DK", "RLLR").drop(CONNECTOME_EXCLUDED)
         region_names = atlas.index
         connectivity.columns = list(region_names)
         connectivity.index = list(region_names)
 
+        if portion != "RLLR":
+            indices = reorder_indices("RLLR", portion)
+            connectivity = connectivity.iloc[indices, indices]
         return connectivity
+    raise NameError("Atlas option not found.")
 
 
 def load_laplacian(n=0):
@@ -104,20 +369,25 @@ def load_laplacian(n=0):
         n=3: L3 = eye(nroi) - diag(1./(sqrt(rowdegree.*coldegree)+eps)) * C; % * diag(1./(sqrt(coldegree)+eps)) ;
         n=4: L4 = eye(nroi) - diag(1./(sqrt(sqrt(rowdegree.*coldegree)+eps))) * C * diag(1./(sqrt(sqrt(rowdegree.*coldegree)+eps)));
         n=5: L5 = eye(nroi) - diag(1./(sqrt((rowdegree+coldegree)/2)+eps)) * C; % * diag(1./(sqrt(coldegree)+eps)) ;
+
+    Results are memoized; each call returns a fresh copy. To build these
+    from any other connectome use `network_utils.compute_laplacian`.
     """
-    laplacian_filepath = get_file_path('connectivity_matrices/laplacians.mat')
-    laplacian = pd.DataFrame(loadmat(laplacian_filepath)['laplacians'][0][0][n])
-
-    DK = load_atlas(atlas="DK", portion="LRRL")
-    DK = DK.drop(
-        [
-            "Right-choroid-plexus",
-            "Left-choroid-plexus",
-            "Right-VentralDC",
-            "Left-VentralDC",
-        ],
-        axis=0,
-    )
+    return _load_laplacian(n).copy()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _load_laplacian(n):
+    if store_utils.has_array("laplacians"):
+        laplacian = store_utils.load_array("laplacians")[n]
+    else:
+        mat = _read_mat('connectivity_matrices/laplacians.mat')
+        laplacian = mat['laplacians'][0][0][n]
+    # no copy: a store memmap stays shared (read-only) with other processes
+    laplacian = pd.DataFrame(laplacian, copy=False)
+
+    DK = _load_atlas("DK", "LRRL")
+    DK = DK.drop(CONNECTOME_EXCLUDED, axis=0)
 
     laplacian.columns = list(DK.index)
     laplacian.index = list(DK.index)
@@ -125,15 +395,291 @@ def load_laplacian(n=0):
     return laplacian
 
 
+BRAIN_PAINTER_REGIONS = ['bankssts','caudalanteriorcingulate','caudalmiddlefrontal','cuneus','entorhinal',
+                         'frontalpole','fusiform','inferiorparietal','inferiortemporal','insula',
+                         'isthmuscingulate','lateraloccipital','lateralorbitofrontal','lingual',
+                         'medialorbitofrontal','middletemporal','paracentral','parahippocampal',
+                         'parsopercularis','parsorbitalis','parstriangularis','pericalcarine',
+                         'postcentral','posteriorcingulate','precentral','precuneus',
+                         'rostralanteriorcingulate','rostralmiddlefrontal','superiorfrontal',
+                         'superiorparietal','superiortemporal','supramarginal','temporalpole',
+                         'transversetemporal','unknown','Accumbens-area','Caudate',
+                         'Cerebellum-White-Matter','Inf-Lat-Vent','Pallidum','Thalamus-Proper',
+                         'Amygdala','Cerebellum-Cortex','Hippocampus','Lateral-Ventricle','Putamen','VentralDC']
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _brain_paint_names(DK_convention):
+    """Left-hemisphere DK name (in `DK_convention`) of each BrainPainter
+    region, None for regions absent from the DK table."""
+    DK = _load_atlas('DK', 'all')
+    DK_left = DK[DK['Hemisphere'] == 'Left']
+    if DK_convention == 'ctx':
+        # name is in the form "ctx-lh-bankssts"
+        names = DK_left.index
+    else:
+        # name is in the form of one of the columns in the DK df
+        names = DK_left[DK_convention]
+
+    lookup = {}
+    for region, name in zip(DK_left['Other Name 5'], names):
+        lookup.setdefault(region, name)
+    return tuple(lookup.get(region) for region in BRAIN_PAINTER_REGIONS)
+
+
+_CACHED_LOADERS = (
+    _read_csv,
+    _read_mat,
+    _load_atlas,
+    _portion_rows,
+    reorder_indices,
+    _dk_alias_index,
+    _load_connectivity,
+    _load_laplacian,
+    _brain_paint_names,
+    store_utils.load_manifest,
+    store_utils.load_array,
+)
+
+
+def cache_clear():
+    """Empty the memoized data loaded by `load_atlas`, `load_connectivity`,
+    `load_laplacian` and the BrainPainter name lookup (e.g. after editing
+    files in ./data/)."""
+    for loader in _CACHED_LOADERS:
+        loader.cache_clear()
+
+
+def cache_info():
+    """Hit/miss statistics of the data loader caches.
+
+    Returns:
+        dict: loader name -> `functools` CacheInfo.
+
+    """
+    return {loader.__name__: loader.cache_info() for loader in _CACHED_LOADERS}
+
+
+def _label_names(labels, values):
+    """Map integer label values to region names.
+
+    Args:
+        labels (dict, list or None): {value: name} mapping, or a list whose
+            position is the label value (e.g. the Yeo .txt label lists).
+        values (np.ndarray): label values to name.
+
+    Returns:
+        list: region names (the raw values when `labels` is None).
+
+    """
+    if labels is None:
+        return values.tolist()
+    if not isinstance(labels, dict):
+        labels = dict(enumerate(labels))
+    return [labels[value] for value in values]
+
+
+def _read_slab(img, start=0, stop=None, box=None):
+    """Read a slab of a label volume through the nibabel proxy, in its
+    native dtype, dropping trailing singleton dimensions (e.g. x*y*z*1).
+
+    Args:
+        img (nibabel image): label volume.
+        start, stop (int): range along the first axis.
+        box (tuple, optional): ((i0, i1), (j0, j1), (k0, k1)) sub-block,
+            overriding `start`/`stop`.
+
+    """
+    if box is None:
+        box = ((start, stop), (None, None), (None, None))
+    slab = np.asarray(img.dataobj[tuple(slice(lo, hi) for lo, hi in box)])
+    return slab.reshape(slab.shape[:3])
+
+
+def _label_values(labels, img, drop_zero, slab_size):
+    """Sorted label values of a volume, restricted to `labels` when given."""
+    if labels is None:
+        num_slices = img.shape[0]
+        values = np.unique(
+            np.concatenate(
+                [
+                    np.unique(_read_slab(img, start, start + slab_size))
+                    for start in range(0, num_slices, slab_size)
+                ]
+            )
+        )
+        if drop_zero:
+            values = values[values != 0]
+        return values
+    if not isinstance(labels, dict):
+        labels = dict(enumerate(labels))
+    return np.sort(np.array(list(labels.keys()), dtype=img.get_data_dtype()))
+
+
+def _overlap_slab(src_img, dst_img, start, stop, src_values, dst_values):
+    """(dst x src) overlap counts of the src voxels in slices [start, stop).
+
+    Only this src slab and the dst block it maps into are read from disk.
+    Module-level so that it can run in a process pool.
+
+    """
+    src_data = _read_slab(src_img, start, stop)
+
+    # source voxels and their label index in the table
+    ijk = np.nonzero(np.isin(src_data, src_values))
+    src_idx = np.searchsorted(src_values, src_data[ijk])
+    del src_data
+
+    # one affine transform for all voxels: src ijk -> xyz -> dst ijk
+    transform = np.linalg.solve(dst_img.affine, src_img.affine)
+    ijk = np.vstack((ijk[0] + start,) + ijk[1:] + (np.ones(len(src_idx)),))
+    dst_ijk = np.round(transform.dot(ijk)[:3]).astype(int)
+    del ijk
+
+    inside = np.all(
+        (dst_ijk >= 0) & (dst_ijk < np.array(dst_img.shape[:3])[:, None]), axis=0
+    )
+    dst_label = np.zeros(len(src_idx), dtype=dst_img.get_data_dtype())
+    if inside.any():
+        dst_ijk = dst_ijk[:, inside]
+        low = dst_ijk.min(axis=1)
+        high = dst_ijk.max(axis=1) + 1
+        dst_block = _read_slab(dst_img, box=tuple(zip(low, high)))
+        dst_label[inside] = dst_block[tuple(dst_ijk - low[:, None])]
+
+    # drop voxels landing on labels we were not asked to count
+    dst_idx = np.searchsorted(dst_values, dst_label)
+    dst_idx = np.minimum(dst_idx, len(dst_values) - 1)
+    keep = dst_values[dst_idx] == dst_label
+
+    return np.bincount(
+        dst_idx[keep] * len(src_values) + src_idx[keep],
+        minlength=len(dst_values) * len(src_values),
+    ).reshape(len(dst_values), len(src_values))
+
+
+def compute_overlap(
+    src_img,
+    dst_img,
+    src_labels=None,
+    dst_labels=None,
+    slab_size=None,
+    num_workers=None,
+):
+    """Count how the voxels of each `src_img` region fall in `dst_img` regions.
+
+    Every labeled voxel of `src_img` is mapped to `dst_img` with a single
+    batched affine transform (nearest neighbour, as `atlasreader` does) and
+    the region-by-region table is built with one `np.bincount` over the
+    paired labels.
+
+    Volumes are read through nibabel's proxy in their native integer dtype
+    (never as float64 copies). With `slab_size`, `src_img` is streamed in
+    slabs of that many slices along its first axis, each slab reading only
+    the `dst_img` block it maps into, and the partial count tables are
+    summed, so peak memory is bounded by the slab size rather than the
+    volume size (e.g. 1 mm or 0.5 mm templates). Slabs can be spread over
+    `num_workers` processes.
+
+    Args:
+        src_img (str or nibabel image): source label volume (e.g. DK).
+        dst_img (str or nibabel image): destination label volume (e.g. Yeo).
+        src_labels (dict or list, optional): label value -> region name of
+            `src_img`. Only voxels with these values are counted. Defaults to
+            every non-zero label in the volume.
+        dst_labels (dict or list, optional): label value -> region name of
+            `dst_img`. Defaults to every label in the volume (including 0).
+            Source voxels falling outside `dst_img` count as label 0.
+        slab_size (int, optional): slices per slab. Defaults to the whole
+            volume at once.
+        num_workers (int, optional): number of processes for the slabs.
+
+    Returns:
+        counts (pd.DataFrame): voxel counts, `dst` regions x `src` regions.
+        normalized (pd.DataFrame): `counts` divided by the column totals.
+
+    """
+    import nibabel
+
+    if isinstance(src_img, str):
+        src_img = nibabel.load(src_img)
+    if isinstance(dst_img, str):
+        dst_img = nibabel.load(dst_img)
+    if slab_size is None:
+        slab_size = src_img.shape[0]
+
+    src_values = _label_values(src_labels, src_img, True, slab_size)
+    dst_values = _label_values(dst_labels, dst_img, False, slab_size)
+
+    jobs = [
+        (src_img, dst_img, start, start + slab_size, src_values, dst_values)
+        for start in range(0, src_img.shape[0], slab_size)
+    ]
+
+    if num_workers is None or num_workers <= 1:
+        counts = sum(_overlap_slab(*job) for job in jobs)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(num_workers) as pool:
+            counts = sum(pool.map(_overlap_slab, *zip(*jobs)))
+
+    counts = pd.DataFrame(
+        counts,
+        index=_label_names(dst_labels, dst_values),
+        columns=_label_names(src_labels, src_values),
+    )
+    normalized = counts.div(counts.sum(axis=0), axis=1)
+
+    return counts, normalized
+
+
 def plot_glass_brains(color, coords, size):
+    """Plot nodes (no edges) on a glass brain. See
+    `render_utils.render_glass_brains` to write many subjects to files."""
+    from nilearn import plotting
+
+    display = plotting.plot_glass_brain(None, display_mode='lyrz')
+    display.add_markers(coords, marker_color=color, marker_size=size)
+
+    return display
+
 
-    num_regions = len(coords)
+def _brain_paint_gather(values, columns, DK_convention, append_nan, fill=None):
+    """Gather the BrainPainter columns of a (subjects x regions) array.
 
-    connec = np.array([[0] * num_regions] * num_regions)
+    Returns the (subjects x regions) BrainPainter array and its region names.
+    Missing regions get `fill` (default: 0 for 'zeros', the data minimum for
+    'min') or are left out for other `append_nan` values.
+
+    """
+    names = _brain_paint_names(DK_convention)
+    positions = pd.Index(columns).get_indexer(list(names))
+    found = positions >= 0
+
+    if append_nan not in ('zeros', 'min'):
+        regions = [region for region, ok in zip(BRAIN_PAINTER_REGIONS, found) if ok]
+        return values[:, positions[found]], regions
+    if fill is None:
+        fill = 0.0 if append_nan == 'zeros' else values.min()
+
+    painted = np.empty((len(values), len(names)))
+    painted[:, found] = values[:, positions[found]]
+    painted[:, ~found] = fill
+    return painted, BRAIN_PAINTER_REGIONS
+
+
+def _brain_paint_frame(painted, regions, index, MAX, vmin, vmax):
+    """Min-max scale BrainPainter values to [0, MAX] and label them."""
+    scaled = MAX * (painted - vmin) / (vmax - vmin)
+    scaled_df = pd.DataFrame(scaled, index=index, columns=regions)
+    scaled_df.index.name = 'Image-name-unique'
+    return scaled_df
 
-    plotting.plot_connectome(connec, coords, node_size = size, node_color=color, display_mode='lyrz')
 
-def return_brain_paint_df(df, DK_convention='ctx', MAX=4, append_nan='zeros'):
+def return_brain_paint_df(
+    df, DK_convention='ctx', MAX=4, append_nan='zeros', columns=None
+):
     """
     Given a df with columns in the DK atlas,
     return a copy df with columns as required by brain_paint
@@ -143,62 +689,96 @@ def return_brain_paint_df(df, DK_convention='ctx', MAX=4, append_nan='zeros'):
     append_nan = what to do with regions not found in the df. 'min' will
       add the minimum value of the df to those regions (e.g. if -100 was no
       disease. 'zero' will add zeros to those regions)
-    """
-    DK = load_atlas('DK')
-
-    brain_painter_regions = ['bankssts','caudalanteriorcingulate','caudalmiddlefrontal','cuneus','entorhinal',
-                             'frontalpole','fusiform','inferiorparietal','inferiortemporal','insula',
-                             'isthmuscingulate','lateraloccipital','lateralorbitofrontal','lingual',
-                             'medialorbitofrontal','middletemporal','paracentral','parahippocampal',
-                             'parsopercularis','parsorbitalis','parstriangularis','pericalcarine',
-                             'postcentral','posteriorcingulate','precentral','precuneus',
-                             'rostralanteriorcingulate','rostralmiddlefrontal','superiorfrontal',
-                             'superiorparietal','superiortemporal','supramarginal','temporalpole',
-                             'transversetemporal','unknown','Accumbens-area','Caudate',
-                             'Cerebellum-White-Matter','Inf-Lat-Vent','Pallidum','Thalamus-Proper',
-                             'Amygdala','Cerebellum-Cortex','Hippocampus','Lateral-Ventricle','Putamen','VentralDC']
+    columns = DK region names of the columns when df is a NumPy array
 
+    The conversion is one column gather through a cached name -> column
+    index plus one vectorized scaling. See `write_brain_paint_csv` to stream
+    tables too large for memory.
+    """
+    if isinstance(df, pd.DataFrame):
+        values, columns, index = df.values, df.columns, df.index
+    else:
+        values = np.asarray(df)
+        index = pd.RangeIndex(len(values))
 
-    #1. generate empty df with brain painter columns
-    brain_painter_df = pd.DataFrame(index=df.index)
-
-    #2. for each brain painter region, find the equivalent region in the df
-        #2.1 if found, get values
-        #2.2 if not found, append ~zeros~ min_val
-    DK_left = DK[DK['Hemisphere'] == 'Left']
-    regions_not_found = []
-    df_min = df.values.min()
-    for region in brain_painter_regions:
-        if DK_convention == 'ctx':
-            # name is in the form "ctx-lh-bankssts"
-            standard_name = DK_left[DK_left['Other Name 5'] == region].index
-        else:
-            # name is in the form of one of the columns in the DK df
-            standard_name = DK_left[DK_left['Other Name 5'] == region][DK_convention]
-
-        if len(standard_name) > 0 and standard_name[0] in df.columns:
-            brain_painter_df[region] = df[standard_name[0]]
-        else:
-            if append_nan == 'zeros':
-                brain_painter_df[region] = 0.0
-            if append_nan == 'min':
-                brain_painter_df[region] = df_min
-            regions_not_found.append(region)
+    painted, regions = _brain_paint_gather(values, columns, DK_convention, append_nan)
 
-    #3. Scale data between 0 and MAX
-    def minmaxscaler(X, min_val, max_val):
-        X_scaled = MAX * (X - min_val) / (max_val - min_val)
-        return(X_scaled)
+    return _brain_paint_frame(
+        painted, regions, index, MAX, painted.min(), painted.max()
+    )
 
-    scaled_df = brain_painter_df.copy()
-    min = scaled_df.values.min()
-    max = scaled_df.values.max()
 
-    for column in scaled_df.columns:
-        scaled_df[column] = minmaxscaler(scaled_df[column], min, max)
+def write_brain_paint_csv(
+    chunks,
+    filename,
+    DK_convention='ctx',
+    MAX=4,
+    append_nan='zeros',
+    columns=None,
+    vmin=None,
+    vmax=None,
+):
+    """Stream (subjects x regions) chunks to a BrainPainter csv file.
+
+    Memory is bounded by the chunk size. The scaling to [0, MAX] uses the
+    minimum and maximum over all chunks, as `return_brain_paint_df` does for
+    a single table: without `vmin`/`vmax` they are computed in a first pass,
+    so `chunks` must then be re-iterable (e.g. a list, or a chunked reader
+    wrapped in a class with `__iter__`). With both given, a one-shot
+    generator is enough and regions missing under append_nan='min' get
+    `vmin`.
 
-    # scaled_df = scaled_df.abs()
+    Args:
+        chunks (iterable): pd.DataFrames with DK columns, or NumPy arrays
+            whose columns are named by `columns`.
+        filename (str): output csv path.
+        DK_convention, MAX, append_nan, columns: see `return_brain_paint_df`.
+        vmin (float, optional): value scaled to 0.
+        vmax (float, optional): value scaled to MAX.
 
-    scaled_df.index.name = 'Image-name-unique'
+    Returns:
+        int: number of rows written.
 
-    return(scaled_df)
+    """
+    def arrays():
+        start = 0
+        for chunk in chunks:
+            if isinstance(chunk, pd.DataFrame):
+                yield chunk.values, chunk.columns, chunk.index
+            else:
+                chunk = np.asarray(chunk)
+                yield chunk, columns, pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+
+    fill = None
+    if vmin is None or vmax is None:
+        if iter(chunks) is chunks:
+            raise ValueError(
+                'chunks must be re-iterable when vmin and vmax are not given.'
+            )
+        # first pass: the data minimum (the 'min' fill), then the range
+        if append_nan == 'min':
+            fill = min(values.min() for values, _, _ in arrays())
+        extrema = [
+            (painted.min(), painted.max())
+            for painted, _ in (
+                _brain_paint_gather(values, cols, DK_convention, append_nan, fill)
+                for values, cols, _ in arrays()
+            )
+        ]
+        vmin = min(low for low, _ in extrema) if vmin is None else vmin
+        vmax = max(high for _, high in extrema) if vmax is None else vmax
+    elif append_nan == 'min':
+        fill = vmin
+
+    num_rows = 0
+    for values, cols, index in arrays():
+        painted, regions = _brain_paint_gather(
+            values, cols, DK_convention, append_nan, fill
+        )
+        scaled_df = _brain_paint_frame(painted, regions, index, MAX, vmin, vmax)
+        first = num_rows == 0
+        scaled_df.to_csv(filename, mode='w' if first else 'a', header=first)
+        num_rows += len(scaled_df)
+
+    return num_rows
@@ -0,0 +1,514 @@
+import itertools
+import json
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from cortography.utils import atlas_utils, store_utils
+
+# stacked cohort layout: <cohort_dir>/connectomes.npy, (N, R, R) float32
+# memmap, described by <cohort_dir>/manifest.json
+COHORT_FILE = "connectomes.npy"
+CACHE_SIZE = 32
+
+
+def build_cohort(
+    matrices, cohort_dir, regions=None, subjects=None, num_subjects=None, **metadata
+):
+    """Ingest per-subject connectomes into a stacked, memory-mapped cohort.
+
+    Matrices are written one at a time into an (N, R, R) float32 .npy file
+    opened as a memmap, so only one subject is in memory at once (pass a
+    generator reading the subject files to ingest large cohorts).
+
+    Args:
+        matrices (iterable): (R, R) connectomes, np.ndarray or pd.DataFrame.
+            DataFrames are reordered to `regions` by name, arrays must
+            already follow it. A stacked (N, R, R) array also works.
+        cohort_dir (str): output directory.
+        regions (list, optional): region names (and order) of the cohort,
+            e.g. `list(atlas_utils.load_connectivity(portion="LRRL").index)`.
+            Defaults to the index of the first DataFrame; required for
+            arrays, whose order cannot be checked.
+        subjects (list, optional): subject identifiers, defaults to 0..N-1.
+        num_subjects (int, optional): N, required when `matrices` has no
+            len() (e.g. a generator).
+        **metadata: extra JSON-serializable manifest entries (e.g.
+            atlas="DK", ordering="LRRL").
+
+    Returns:
+        dict: the manifest.
+
+    """
+    if num_subjects is None:
+        num_subjects = len(subjects) if subjects is not None else len(matrices)
+    matrices = iter(matrices)
+    first = next(matrices)
+
+    if regions is None:
+        if not isinstance(first, pd.DataFrame):
+            raise ValueError("regions are required for array connectomes.")
+        regions = list(first.index)
+    num_regions = len(regions)
+
+    os.makedirs(cohort_dir, exist_ok=True)
+    stack = np.lib.format.open_memmap(
+        os.path.join(cohort_dir, COHORT_FILE),
+        mode="w+",
+        dtype=np.float32,
+        shape=(num_subjects, num_regions, num_regions),
+    )
+
+    count = 0
+    for matrix in itertools.chain([first], matrices):
+        if isinstance(matrix, pd.DataFrame):
+            matrix = matrix.reindex(index=regions, columns=regions).values
+        stack[count] = matrix
+        count += 1
+    if count != num_subjects:
+        raise ValueError("Expected {} connectomes, got {}.".format(num_subjects, count))
+    stack.flush()
+    del stack
+
+    manifest = dict(metadata)
+    manifest.update(
+        {
+            "file": COHORT_FILE,
+            "shape": [num_subjects, num_regions, num_regions],
+            "dtype": np.dtype(np.float32).str,
+            "regions": list(regions),
+            "subjects": list(range(num_subjects)) if subjects is None else subjects,
+        }
+    )
+    # written last, as in `store_utils.build_store`
+    store_utils._write_manifest(cohort_dir, manifest)
+    return manifest
+
+
+def load_cohort(cohort_dir):
+    """Open a cohort written by `build_cohort`, read-only and zero-copy.
+
+    Args:
+        cohort_dir (str): cohort directory.
+
+    Returns:
+        stack (np.memmap): (N, R, R) float32 connectomes.
+        manifest (dict): "regions", "subjects", "shape", ... of the stack.
+
+    """
+    with open(os.path.join(cohort_dir, store_utils.MANIFEST)) as f:
+        manifest = json.load(f)
+    stack = np.load(os.path.join(cohort_dir, manifest["file"]), mmap_mode="r")
+    return stack, manifest
+
+
+def _subject_indices(num_subjects, subjects):
+    if subjects is None:
+        return np.arange(num_subjects)
+    subjects = np.asarray(subjects)
+    if subjects.dtype == bool:
+        return np.flatnonzero(subjects)
+    return np.sort(subjects)
+
+
+def cohort_statistics(
+    stack, subjects=None, percentiles=None, ddof=1, chunk_size=256, block_size=2**28
+):
+    """Group mean, variance and percentiles of stacked connectomes.
+
+    Mean and variance are computed in one pass over chunks of `chunk_size`
+    subjects, merging per-chunk moments (Chan et al.) in float64. Exact
+    percentiles read the stack in blocks of rows across all selected
+    subjects, each block holding at most `block_size` bytes. Memory never
+    depends on the cohort size beyond these blocks.
+
+    Args:
+        stack (np.ndarray or np.memmap): (N, R, R) connectomes, e.g. from
+            `load_cohort`.
+        subjects (array, optional): indices or boolean mask of the subjects
+            to include, to stratify the cohort. Defaults to all.
+        percentiles (list of float, optional): percentiles (0-100) to compute.
+        ddof (int): delta degrees of freedom of the variance.
+        chunk_size (int): subjects read at once for the moments.
+        block_size (int): bytes read at once for the percentiles.
+
+    Returns:
+        dict: "count" (int), "mean" and "variance" ((R, R) float64) and, with
+        `percentiles`, "percentiles" ((Q, R, R) float32, in the order given).
+
+    """
+    indices = _subject_indices(len(stack), subjects)
+    num_regions = stack.shape[1:]
+
+    count = 0
+    mean = np.zeros(num_regions)
+    m2 = np.zeros(num_regions)
+    for start in range(0, len(indices), chunk_size):
+        chunk = np.asarray(stack[indices[start : start + chunk_size]], dtype=float)
+        chunk_count = len(chunk)
+        chunk_mean = chunk.mean(axis=0)
+        chunk_m2 = ((chunk - chunk_mean) ** 2).sum(axis=0)
+
+        total = count + chunk_count
+        delta = chunk_mean - mean
+        mean += delta * (chunk_count / total)
+        m2 += chunk_m2 + delta**2 * (count * chunk_count / total)
+        count = total
+
+    statistics = {
+        "count": count,
+        "mean": mean,
+        "variance": m2 / max(count - ddof, 1),
+    }
+
+    if percentiles is not None:
+        row_bytes = len(indices) * np.prod(num_regions[1:]) * stack.dtype.itemsize
+        rows_per_block = max(int(block_size // max(row_bytes, 1)), 1)
+        values = np.empty((len(percentiles),) + num_regions, dtype=np.float32)
+        for row in range(0, num_regions[0], rows_per_block):
+            block = stack[indices, row : row + rows_per_block]
+            values[:, row : row + rows_per_block] = np.percentile(
+                block, percentiles, axis=0
+            )
+        statistics["percentiles"] = values
+
+    return statistics
+
+
+def group_statistics(stack, groups, **kwargs):
+    """`cohort_statistics` of each group of subjects.
+
+    Args:
+        stack (np.ndarray or np.memmap): (N, R, R) connectomes.
+        groups (array): (N,) group label of each subject (e.g. diagnosis).
+        **kwargs: see `cohort_statistics`.
+
+    Returns:
+        dict: group label -> statistics.
+
+    """
+    groups = np.asarray(groups)
+    return {
+        group: cohort_statistics(stack, subjects=groups == group, **kwargs)
+        for group in np.unique(groups)
+    }
+
+
+# Packed connectomes: symmetric (R, R) matrices stored as the (E,) vector of
+# their upper triangle (row-major, as np.triu_indices), stacks as (..., E).
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def triu_indices(num_regions, diagonal=True):
+    """Row and column of each packed edge (read-only, cached).
+
+    Args:
+        num_regions (int): R.
+        diagonal (bool): whether the diagonal is packed (E = R(R+1)/2, e.g.
+            for Laplacians) or not (E = R(R-1)/2, for connectomes with an
+            empty diagonal).
+
+    """
+    rows, cols = np.triu_indices(num_regions, k=0 if diagonal else 1)
+    rows.flags.writeable = False
+    cols.flags.writeable = False
+    return rows, cols
+
+
+def num_packed_regions(num_edges, diagonal=True):
+    """R of packed connectomes with `num_edges` edges."""
+    num_regions = int(round((np.sqrt(8 * num_edges + 1) + (-1 if diagonal else 1)) / 2))
+    if len(triu_indices(num_regions, diagonal)[0]) != num_edges:
+        raise ValueError(str(num_edges) + " is not a packed triangle size.")
+    return num_regions
+
+
+def pack_connectome(C, diagonal=True, dtype=np.float32):
+    """Pack symmetric connectomes into their upper triangle.
+
+    Halves memory and bandwidth. The lower triangle is not read.
+
+    Args:
+        C (np.ndarray or pd.DataFrame): (R, R) matrix or (..., R, R) stack
+            (e.g. a `load_cohort` memmap).
+        diagonal (bool): keep the diagonal, see `triu_indices`.
+        dtype: packed dtype, e.g. np.float32 or np.float16.
+
+    Returns:
+        np.ndarray: (..., E) packed edges.
+
+    """
+    if isinstance(C, pd.DataFrame):
+        C = C.values
+    rows, cols = triu_indices(C.shape[-1], diagonal)
+    return np.asarray(C[..., rows, cols], dtype=dtype)
+
+
+def unpack_connectome(packed, diagonal=True, regions=None, dtype=None):
+    """Dense symmetric matrices from packed edges.
+
+    Args:
+        packed (np.ndarray): (..., E) packed edges.
+        diagonal (bool): whether the diagonal was packed (else it is 0).
+        regions (list, optional): region names; a single matrix is then
+            returned as a DataFrame.
+        dtype (optional): dense dtype, defaults to the packed one.
+
+    Returns:
+        np.ndarray or pd.DataFrame: (..., R, R) matrices.
+
+    """
+    packed = np.asarray(packed)
+    num_regions = num_packed_regions(packed.shape[-1], diagonal)
+    rows, cols = triu_indices(num_regions, diagonal)
+
+    dense = np.zeros(
+        packed.shape[:-1] + (num_regions, num_regions),
+        dtype=packed.dtype if dtype is None else dtype,
+    )
+    dense[..., rows, cols] = packed
+    dense[..., cols, rows] = packed
+
+    if regions is not None and dense.ndim == 2:
+        return pd.DataFrame(dense, index=regions, columns=regions)
+    return dense
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _packed_permutation(indices, diagonal):
+    """Edge permutation of a region permutation, on packed connectomes."""
+    indices = np.array(indices)
+    rows, cols = triu_indices(len(indices), diagonal)
+    old_rows = np.minimum(indices[rows], indices[cols])
+    old_cols = np.maximum(indices[rows], indices[cols])
+
+    # position of (row, col) in the packed vector
+    edge = np.full((len(indices), len(indices)), -1)
+    edge[triu_indices(len(indices), diagonal)] = np.arange(len(rows))
+    permutation = edge[old_rows, old_cols]
+    permutation.flags.writeable = False
+    return permutation
+
+
+def reorder_packed(packed, source, target=None, connectome=True, diagonal=True):
+    """Reorder the regions of packed connectomes with one gather.
+
+    Args:
+        packed (np.ndarray): (..., E) packed edges.
+        source (str or array): DK ordering of the data (see
+            `atlas_utils.reorder_indices`), or an explicit permutation of
+            the regions (dense `C[idx][:, idx]`) when `target` is None.
+        target (str, optional): desired DK ordering.
+        connectome (bool): see `atlas_utils.reorder_indices`.
+        diagonal (bool): whether the diagonal is packed.
+
+    Returns:
+        np.ndarray: (..., E) reordered packed edges.
+
+    """
+    if target is None:
+        indices = np.asarray(source)
+    else:
+        indices = atlas_utils.reorder_indices(source, target, connectome)
+    permutation = _packed_permutation(tuple(indices.tolist()), diagonal)
+    return packed[..., permutation]
+
+
+def threshold_packed(packed, threshold=None, density=None, diagonal=True):
+    """Zero weak edges of packed connectomes.
+
+    Args:
+        packed (np.ndarray): (..., E) packed edges.
+        threshold (float, optional): absolute weight below which edges are
+            removed.
+        density (float, optional): fraction (0-1) of the strongest
+            off-diagonal edges kept per connectome, instead of `threshold`.
+        diagonal (bool): whether the diagonal is packed (it is kept as is).
+
+    Returns:
+        np.ndarray: (..., E) thresholded copy.
+
+    """
+    packed = np.array(packed)
+    rows, cols = triu_indices(num_packed_regions(packed.shape[-1], diagonal), diagonal)
+    edges = rows != cols
+
+    if density is not None:
+        weights = packed[..., edges]
+        num_kept = int(round(density * weights.shape[-1]))
+        if num_kept == 0:
+            threshold = np.inf
+        else:
+            threshold = -np.partition(-weights, num_kept - 1, axis=-1)[
+                ..., num_kept - 1 : num_kept
+            ]
+        weights[weights < threshold] = 0
+        packed[..., edges] = weights
+    elif threshold is not None:
+        packed[..., edges] = np.where(
+            packed[..., edges] < threshold, 0, packed[..., edges]
+        )
+
+    return packed
+
+
+def edge_correlation(packed, covariate, chunk_size=4096):
+    """Pearson correlation of every edge with a covariate across subjects.
+
+    Args:
+        packed (np.ndarray): (N, E) packed edges (e.g. a packed cohort).
+        covariate (array): (N,) subject values (e.g. age).
+        chunk_size (int): edges processed at once.
+
+    Returns:
+        np.ndarray: (E,) correlations (NaN for constant edges).
+
+    """
+    covariate = np.asarray(covariate, dtype=float)
+    covariate = covariate - covariate.mean()
+    covariate /= np.linalg.norm(covariate)
+
+    correlation = np.empty(packed.shape[-1])
+    for start in range(0, packed.shape[-1], chunk_size):
+        block = np.asarray(packed[:, start : start + chunk_size], dtype=float)
+        block = block - block.mean(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            correlation[start : start + chunk_size] = covariate.dot(
+                block
+            ) / np.linalg.norm(block, axis=0)
+    return correlation
+
+
+SIMILARITY_METHODS = ["pearson", "spearman", "cosine"]
+
+
+def _similarity_rows(connectomes, start, stop, method, diagonal, dtype):
+    """Unit-norm edge vectors of connectomes [start, stop), whose dot
+    products are the `method` similarities."""
+    compute_dtype = np.promote_types(dtype, np.float32)
+    block = np.asarray(connectomes[start:stop])
+    if block.ndim == 3:
+        block = pack_connectome(block, diagonal=False, dtype=compute_dtype)
+    elif diagonal:
+        rows, cols = triu_indices(num_packed_regions(block.shape[-1]))
+        block = block[:, rows != cols]
+    block = block.astype(compute_dtype)
+
+    if method == "spearman":
+        from scipy.stats import rankdata
+
+        block = rankdata(block, axis=-1).astype(compute_dtype)
+    if method in ("pearson", "spearman"):
+        block -= block.mean(axis=-1, keepdims=True)
+    elif method != "cosine":
+        raise ValueError(
+            "Similarity method must be one of " + ", ".join(SIMILARITY_METHODS)
+        )
+
+    norms = np.linalg.norm(block, axis=-1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        block /= norms
+    return block.astype(dtype, copy=False)
+
+
+def _standardized_edges(connectomes, path, method, diagonal, block_size, dtype):
+    """Write the `_similarity_rows` of a whole cohort, block by block, to a
+    .npy memmap at `path`."""
+    edges = None
+    for start in range(0, len(connectomes), block_size):
+        block = _similarity_rows(
+            connectomes, start, start + block_size, method, diagonal, dtype
+        )
+        if edges is None:
+            edges = np.lib.format.open_memmap(
+                path, mode="w+", dtype=dtype, shape=(len(connectomes), block.shape[-1])
+            )
+        edges[start : start + len(block)] = block
+    return edges
+
+
+def connectome_similarity(
+    connectomes,
+    other=None,
+    method="pearson",
+    diagonal=True,
+    block_size=2048,
+    dtype=np.float32,
+    out=None,
+    scratch_dir=None,
+):
+    """Pairwise similarity of connectomes over their upper-triangle edges.
+
+    Edge vectors are standardized once, `block_size` subjects at a time
+    (ranked first for "spearman", not centered for "cosine"), into a
+    temporary `dtype` memmap. The N x M matrix is then filled by matrix
+    products of `block_size` x `block_size` tiles read back from it, so
+    cohorts of tens of thousands of subjects never need more than a few
+    blocks in memory besides the output (which can be a memmap).
+
+    Args:
+        connectomes (np.ndarray): (N, R, R) stack (e.g. a `load_cohort`
+            memmap) or (N, E) packed edges (see `pack_connectome`).
+        other (np.ndarray, optional): second cohort, (M, R, R) or (M, E),
+            for an N x M cross-similarity. Defaults to `connectomes`.
+        method (str): "pearson", "spearman" or "cosine".
+        diagonal (bool): whether packed input includes the diagonal, as
+            with `pack_connectome`'s default. It is dropped before comparing
+            edges. Ignored for (R, R) stacks, whose diagonal is never used.
+        block_size (int): subjects per block and tile.
+        dtype: dtype of the standardized edges and of the output.
+        out (np.ndarray, optional): (N, M) array to write into.
+        scratch_dir (str, optional): directory of the temporary memmaps
+            (N x E and, for `other`, M x E `dtype` values). Defaults to the
+            system temporary directory.
+
+    Returns:
+        np.ndarray: (N, M) similarities (NaN for constant connectomes).
+
+    """
+    import tempfile
+
+    same = other is None
+    other = connectomes if same else other
+    if out is None:
+        out = np.empty((len(connectomes), len(other)), dtype=dtype)
+
+    with tempfile.TemporaryDirectory(dir=scratch_dir) as scratch:
+        rows = _standardized_edges(
+            connectomes,
+            os.path.join(scratch, "rows.npy"),
+            method,
+            diagonal,
+            block_size,
+            dtype,
+        )
+        if same:
+            columns = rows
+        else:
+            columns = _standardized_edges(
+                other,
+                os.path.join(scratch, "columns.npy"),
+                method,
+                diagonal,
+                block_size,
+                dtype,
+            )
+
+        for row_start in range(0, len(connectomes), block_size):
+            row_block = np.asarray(rows[row_start : row_start + block_size])
+            row_stop = row_start + len(row_block)
+            for col_start in range(0, len(other), block_size):
+                col_stop = min(col_start + block_size, len(other))
+                if same and col_start < row_start:
+                    # symmetric: copy the tile computed above the diagonal
+                    tile = out[col_start:col_stop, row_start:row_stop].T
+                else:
+                    tile = row_block.dot(columns[col_start:col_stop].T)
+                out[row_start:row_stop, col_start:col_stop] = tile
+
+        # release the memmaps before their files are removed
+        del rows, columns, row_block
+
+    return out
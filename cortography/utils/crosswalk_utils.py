@@ -0,0 +1,210 @@
+import os
+import re
+from collections import deque
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from cortography.utils import atlas_utils
+
+CACHE_SIZE = 32
+
+# voxel overlap counts between atlases, (dst regions x src regions) tables
+# as written by `atlas_utils.compute_overlap`: (src, dst) -> csv or DataFrame
+_CROSSWALKS = {
+    ("AAL", "Yeo7"): "atlases/AAL/AAL_dictionary_counts.csv",
+}
+
+# rows/columns of overlap tables that are not regions (e.g. white matter)
+BACKGROUND_LABELS = ["None", ""]
+
+
+def yeo_labels(networks=7):
+    """Yeo network names, indexed by label value (0 is "None").
+
+    Args:
+        networks (int): 7 or 17.
+
+    Returns:
+        list: e.g. ["None", "Visual", "Somatomotor", ...].
+
+    """
+    filename = "atlases/Yeo/Yeo2011_{}Networks_MNI152.txt".format(networks)
+    with open(atlas_utils.get_file_path(filename)) as f:
+        lines = [line.split() for line in f.read().split("\n")]
+    return ["None"] + [line[-1] for line in lines if line]
+
+
+def _region_name(name):
+    # tables written from the Yeo .txt files keep their "  1     Visual" lines
+    return re.sub(r"^\s*\d+\s+", "", str(name)).strip()
+
+
+def register_crosswalk(src, dst, counts):
+    """Register voxel overlap counts between two atlases.
+
+    Args:
+        src (str): source atlas name, e.g. "DK".
+        dst (str): destination atlas name, e.g. "Yeo17".
+        counts (pd.DataFrame or str): (dst regions x src regions) voxel counts,
+            e.g. the first output of `atlas_utils.compute_overlap(src_img,
+            dst_img, ...)`, or the path of such a table saved as csv.
+
+    """
+    _CROSSWALKS[(src, dst)] = counts
+    _overlap_counts.cache_clear()
+    crosswalk_matrix.cache_clear()
+
+
+def registered_crosswalks():
+    """(src, dst) atlas pairs with registered overlap counts."""
+    return list(_CROSSWALKS)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _overlap_counts(src, dst):
+    """Sparse (dst x src) overlap counts with their region names, background
+    rows and columns removed."""
+    counts = _CROSSWALKS[(src, dst)]
+    if isinstance(counts, str):
+        path = counts
+        if not os.path.isabs(path):
+            path = atlas_utils.get_file_path(path)
+        counts = pd.read_csv(path, index_col=0, keep_default_na=False)
+
+    counts = counts.rename(index=_region_name, columns=_region_name)
+    counts = counts.drop(
+        index=BACKGROUND_LABELS, columns=BACKGROUND_LABELS, errors="ignore"
+    )
+
+    matrix = sparse.csr_matrix(counts.values.astype(float))
+    return matrix, tuple(counts.columns), tuple(counts.index)
+
+
+def _direct_matrix(src, dst):
+    """Crosswalk weights of one registered pair, in either direction.
+
+    Going src -> dst, each dst region is the voxel-weighted average of the
+    src regions overlapping it (dst columns sum to 1).
+
+    """
+    if (src, dst) in _CROSSWALKS:
+        counts, src_names, dst_names = _overlap_counts(src, dst)
+        # (dst x src) counts -> rows normalized over src, transposed
+        totals = np.asarray(counts.sum(axis=1)).ravel()
+        weights = sparse.diags(1.0 / np.where(totals > 0, totals, 1)).dot(counts)
+        return sparse.csr_matrix(weights.T), src_names, dst_names
+
+    counts, dst_names, src_names = _overlap_counts(dst, src)
+    # (src x dst) counts -> columns normalized over src, kept as is
+    totals = np.asarray(counts.sum(axis=0)).ravel()
+    weights = counts.dot(sparse.diags(1.0 / np.where(totals > 0, totals, 1)))
+    return sparse.csr_matrix(weights), src_names, dst_names
+
+
+def _crosswalk_path(src, dst):
+    """Shortest chain of registered atlas pairs from `src` to `dst`."""
+    neighbours = {}
+    for a, b in _CROSSWALKS:
+        neighbours.setdefault(a, set()).add(b)
+        neighbours.setdefault(b, set()).add(a)
+
+    previous = {src: None}
+    queue = deque([src])
+    while queue:
+        atlas = queue.popleft()
+        if atlas == dst:
+            path = [dst]
+            while previous[path[-1]] is not None:
+                path.append(previous[path[-1]])
+            return path[::-1]
+        for neighbour in sorted(neighbours.get(atlas, ())):
+            if neighbour not in previous:
+                previous[neighbour] = atlas
+                queue.append(neighbour)
+
+    raise KeyError("No crosswalk registered from " + src + " to " + dst + ".")
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def crosswalk_matrix(src, dst, via=None):
+    """Sparse weight matrix translating region-wise data between atlases.
+
+    `data_dst = data_src @ W`, for (subjects x regions) arrays. Atlases
+    without a registered pair are bridged through intermediate atlases
+    (e.g. AAL -> Yeo7 -> DK) by multiplying the matrices of each hop.
+    Matrices are cached. `src` and `dst` must differ.
+
+    Args:
+        src (str): source atlas, e.g. "AAL".
+        dst (str): destination atlas, e.g. "Yeo7".
+        via (tuple of str, optional): intermediate atlases. Defaults to the
+            shortest chain of registered pairs.
+
+    Returns:
+        W (scipy.sparse.csr_matrix): (src regions x dst regions) weights.
+        src_names (tuple): region names of the rows of W.
+        dst_names (tuple): region names of the columns of W.
+
+    """
+    if src == dst:
+        raise ValueError("No crosswalk needed from " + src + " to itself.")
+    if via is None:
+        path = _crosswalk_path(src, dst)
+    else:
+        path = [src] + ([via] if isinstance(via, str) else list(via)) + [dst]
+
+    weights, src_names, names = _direct_matrix(path[0], path[1])
+    for hop_src, hop_dst in zip(path[1:-1], path[2:]):
+        hop, hop_names, dst_names = _direct_matrix(hop_src, hop_dst)
+        # align the regions shared by both hops
+        rows = pd.Index(hop_names).get_indexer(names)
+        shared = rows >= 0
+        weights = weights[:, shared].dot(hop[rows[shared]])
+        names = dst_names
+
+    weights = sparse.csr_matrix(weights)
+    weights.eliminate_zeros()
+    return weights, src_names, names
+
+
+def translate(data, src, dst, via=None, src_regions=None):
+    """Translate region-wise data between atlases with one sparse matmul.
+
+    Args:
+        data (pd.DataFrame, np.ndarray or scipy.sparse matrix): (subjects x
+            regions) values in the `src` atlas. DataFrame columns are matched
+            by region name (missing regions count as 0).
+        src (str): source atlas.
+        dst (str): destination atlas.
+        via (tuple of str, optional): see `crosswalk_matrix`.
+        src_regions (list, optional): region names of the columns of an
+            array `data`. Defaults to the row order of `crosswalk_matrix`.
+
+    Returns:
+        (subjects x dst regions) translated data: a DataFrame for DataFrame
+        input, an array otherwise.
+
+    """
+    if via is not None and not isinstance(via, str):
+        via = tuple(via)
+    weights, src_names, dst_names = crosswalk_matrix(src, dst, via)
+
+    if isinstance(data, pd.DataFrame):
+        values = data.reindex(columns=list(src_names), fill_value=0).values
+        return pd.DataFrame(
+            weights.T.dot(values.T).T, index=data.index, columns=list(dst_names)
+        )
+
+    if src_regions is not None:
+        rows = pd.Index(src_regions).get_indexer(src_names)
+        found = rows >= 0
+        weights = sparse.csr_matrix(
+            (np.ones(found.sum()), (rows[found], np.flatnonzero(found))),
+            shape=(len(src_regions), len(src_names)),
+        ).dot(weights)
+
+    translated = weights.T.dot(data.T).T
+    return translated.toarray() if sparse.issparse(translated) else translated
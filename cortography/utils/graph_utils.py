@@ -0,0 +1,396 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse import csgraph
+
+from cortography.utils import atlas_utils, store_utils
+
+# Graph metrics of weighted, undirected connectomes, computed over whole
+# (N, R, R) stacks at once. Definitions follow the Brain Connectivity
+# Toolbox (Rubinov & Sporns, 2010); connection lengths are 1 / weight.
+
+GRAPH_METRICS = [
+    "strength",
+    "degree",
+    "clustering",
+    "betweenness",
+    "global_efficiency",
+    "local_efficiency",
+]
+
+# shortest-path matrices kept by `shortest_paths`, keyed by connectome hash
+CACHE_SIZE = 32
+
+_paths_cache = store_utils._LRUCache(CACHE_SIZE)
+
+
+def _as_stack(W, dtype):
+    """(N, R, R) weights with an empty diagonal, and whether the input was
+    a single matrix."""
+    if isinstance(W, pd.DataFrame):
+        W = W.values
+    W = np.asarray(W, dtype=dtype)
+    single = W.ndim == 2
+    W = np.array(W[None] if single else W)
+    diagonal = np.arange(W.shape[-1])
+    W[:, diagonal, diagonal] = 0
+    return W, single
+
+
+def _lengths(W):
+    with np.errstate(divide="ignore"):
+        return np.where(W > 0, 1 / W, np.inf)
+
+
+def _shortest_paths(L):
+    """All-pairs shortest path lengths of a (..., R, R) stack of length
+    matrices (np.inf: no edge), with a batched Floyd-Warshall."""
+    D = np.array(L)
+    diagonal = np.arange(D.shape[-1])
+    D[..., diagonal, diagonal] = 0
+    for k in range(D.shape[-1]):
+        np.minimum(D, D[..., :, k, None] + D[..., None, k, :], out=D)
+    return D
+
+
+def _clustering(W):
+    # Onnela et al. (2005): geometric mean of the triangle weights, with the
+    # weights scaled by the largest one of each connectome
+    scaled = np.cbrt(W / W.max(axis=(-2, -1), keepdims=True).clip(min=1e-30))
+    cycles = np.einsum("nij,njk,nki->ni", scaled, scaled, scaled)
+    k = (W != 0).sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(k > 1, cycles / (k * (k - 1)), 0)
+
+
+def _betweenness(W):
+    # Brandes' recursions, solved for every source at once as two batched
+    # linear systems on the shortest-path DAGs
+    L = _lengths(W.astype(float))
+    D = _shortest_paths(L)
+    num_regions = W.shape[-1]
+    eye = np.eye(num_regions)
+
+    # dag[n, s, u, t]: edge u -> t lies on a shortest path from s
+    with np.errstate(invalid="ignore"):
+        through = D[:, :, :, None] + L[:, None, :, :]
+        dag = np.isclose(through, D[:, :, None, :], rtol=1e-10, atol=0)
+    dag &= np.isfinite(through)
+
+    # number of shortest paths: sigma_s = dag_s^T sigma_s + e_s
+    sigma = np.linalg.solve(
+        eye - np.swapaxes(dag, -1, -2),
+        np.broadcast_to(eye[..., None], dag.shape[:-1] + (1,)),
+    )[..., 0]
+
+    # dependencies:
+    # delta_s(v) = sum_w dag_s(v, w) sigma_s(v) / sigma_s(w) (1 + delta_s(w))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = np.where(dag, sigma[..., :, None] / sigma[..., None, :], 0)
+    delta = np.linalg.solve(eye - ratios, ratios.sum(axis=-1)[..., None])[..., 0]
+    delta[:, np.arange(num_regions), np.arange(num_regions)] = 0
+
+    return delta.sum(axis=1)
+
+
+def _global_efficiency(W):
+    D = _shortest_paths(_lengths(W.astype(float)))
+    num_regions = W.shape[-1]
+    with np.errstate(divide="ignore"):
+        inverse = 1 / D
+    inverse[:, np.arange(num_regions), np.arange(num_regions)] = 0
+    return inverse.sum(axis=(-2, -1)) / (num_regions * (num_regions - 1))
+
+
+def _local_efficiency(W, batch_size=1024):
+    # Rubinov & Sporns (2010): E_loc(i) = sum_{j != h} (w_ij w_ih
+    # / d_jh(N_i))^(1/3) / (k_i (k_i - 1)), d_jh(N_i) being the shortest path
+    # length between neighbours j and h within the neighbourhood of i, with
+    # the weights scaled by the largest one of each connectome
+    W = W.astype(float)
+    W = W / W.max(axis=(-2, -1), keepdims=True).clip(min=1e-30)
+    num_subjects, num_regions = W.shape[:2]
+    neighbours = W != 0
+    L = _lengths(W)
+    scaled = np.cbrt(W)
+
+    # one (k_i, k_i) neighbourhood subgraph per node; subgraphs are sorted by
+    # size and batched, each batch padded to its largest neighbourhood
+    k = neighbours.sum(axis=-1).ravel()
+    members = np.argsort(~neighbours, axis=-1, kind="stable")
+    numerator = np.zeros(num_subjects * num_regions)
+    subgraphs = np.argsort(k, kind="stable")
+    subgraphs = subgraphs[k[subgraphs] > 1]
+    for start in range(0, len(subgraphs), batch_size):
+        batch = subgraphs[start : start + batch_size]
+        size = k[batch].max()
+        subject, node = np.divmod(batch, num_regions)
+        nodes = members[subject, node, :size]
+        valid = np.arange(size) < k[batch, None]
+
+        sub_lengths = L[subject[:, None, None], nodes[:, :, None], nodes[:, None, :]]
+        sub_lengths[~(valid[:, :, None] & valid[:, None, :])] = np.inf
+        with np.errstate(divide="ignore"):
+            inverse = 1 / _shortest_paths(sub_lengths)
+        inverse[:, np.arange(size), np.arange(size)] = 0
+
+        weights = np.where(valid, scaled[subject[:, None], node[:, None], nodes], 0)
+        numerator[batch] = np.einsum("bj,bjh,bh->b", weights, np.cbrt(inverse), weights)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        efficiency = np.where(k > 1, numerator / (k * (k - 1)), 0)
+    return efficiency.reshape(num_subjects, num_regions)
+
+
+_METRICS = {
+    "strength": lambda W: W.sum(axis=-1),
+    "degree": lambda W: (W != 0).sum(axis=-1),
+    "clustering": _clustering,
+    "betweenness": _betweenness,
+    "global_efficiency": _global_efficiency,
+    "local_efficiency": _local_efficiency,
+}
+
+
+def rich_club(W, max_degree=None, weighted=True, dtype=np.float32):
+    """Rich-club coefficients of connectomes, for every degree level.
+
+    Args:
+        W (np.ndarray or pd.DataFrame): (R, R) or (N, R, R) weights.
+        max_degree (int, optional): last degree level k. Defaults to the
+            largest degree in the stack.
+        weighted (bool): weighted coefficient (Opsahl et al., 2008: weight
+            among the nodes of degree > k over the same number of strongest
+            edges of the whole network) or binary density of that club.
+        dtype: output dtype.
+
+    Returns:
+        np.ndarray: (..., K) coefficients for k = 1..K (NaN for clubs with
+        fewer than two nodes).
+
+    """
+    W, single = _as_stack(W, dtype)
+    k = (W != 0).sum(axis=-1)
+    if max_degree is None:
+        max_degree = int(k.max())
+
+    # strongest edges first, one row per connectome
+    rows, cols = np.triu_indices(W.shape[-1], 1)
+    edges = W[:, rows, cols]
+    ranked = np.cumsum(-np.sort(-edges, axis=-1), axis=-1)
+
+    coefficients = np.full((len(W), max_degree), np.nan, dtype=dtype)
+    for level in range(1, max_degree + 1):
+        club = (k > level).astype(W.dtype)
+        num_nodes = club.sum(axis=-1)
+        club_weights = np.einsum("ni,nij,nj->n", club, W, club) / 2
+        club_edges = np.einsum("ni,nij,nj->n", club, (W != 0).astype(W.dtype), club) / 2
+        valid = num_nodes > 1
+        if weighted:
+            top = ranked[np.arange(len(W)), np.maximum(club_edges.astype(int) - 1, 0)]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                values = np.where(club_edges > 0, club_weights / top, np.nan)
+        else:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                values = club_edges / (num_nodes * (num_nodes - 1) / 2)
+        coefficients[:, level - 1] = np.where(valid, values, np.nan)
+
+    return coefficients[0] if single else coefficients
+
+
+def graph_metrics(W, metrics=None, chunk_size=16, dtype=np.float32):
+    """Node and network graph metrics of a stack of weighted connectomes.
+
+    Every metric is computed for a whole chunk of subjects at once with
+    batched array operations (no per-subject or per-node Python loops), so
+    memory is bounded by `chunk_size` (betweenness, the most demanding,
+    holds a few chunk_size * R^3 float64 arrays).
+
+    Args:
+        W (np.ndarray or pd.DataFrame): (R, R) or (N, R, R) non-negative,
+            symmetric weights, e.g. `atlas_utils.load_connectivity()` or a
+            `connectome_utils.load_cohort` memmap.
+        metrics (list of str, optional): names from GRAPH_METRICS. Defaults
+            to all of them.
+        chunk_size (int): subjects processed at once.
+        dtype: dtype of the input in memory and of the results (path-based
+            metrics are accumulated in float64).
+
+    Returns:
+        dict: metric -> (N, R) node values, or (N,) for "global_efficiency"
+        (without the N axis for a single matrix).
+
+    """
+    metrics = GRAPH_METRICS if metrics is None else list(metrics)
+    unknown = set(metrics) - set(_METRICS)
+    if unknown:
+        raise ValueError("Unknown graph metrics: " + ", ".join(sorted(unknown)))
+
+    if isinstance(W, pd.DataFrame):
+        W = W.values
+    single = np.ndim(W) == 2
+    stack = W[None] if single else W
+
+    results = {metric: [] for metric in metrics}
+    for start in range(0, len(stack), chunk_size):
+        chunk, _ = _as_stack(stack[start : start + chunk_size], dtype)
+        for metric in metrics:
+            results[metric].append(_METRICS[metric](chunk).astype(dtype))
+
+    results = {metric: np.concatenate(values) for metric, values in results.items()}
+    if single:
+        results = {metric: values[0] for metric, values in results.items()}
+    return results
+
+
+def load_fiber_matrices():
+    """Bundled mean80 tractography: fiber counts and mean fiber lengths (mm).
+
+    Once the data store is built, both are read-only views of its memmaps
+    (shared by every process), copy them before modifying in place.
+
+    Returns:
+        counts (pd.DataFrame): (86, 86) fiber counts.
+        lengths (pd.DataFrame): (86, 86) fiber lengths, same regions.
+
+    """
+    if store_utils.has_array("mean80_fiberlength"):
+        regions = store_utils.load_manifest()["arrays"]["mean80_fibercount"]["regions"]
+        counts = store_utils.load_array("mean80_fibercount")
+        lengths = store_utils.load_array("mean80_fiberlength")
+    else:
+        table = pd.read_csv(
+            atlas_utils.get_file_path("connectivity_matrices/mean80_fibercount.csv")
+        )
+        regions = list(table.columns)
+        counts = table.values.astype(float)
+        lengths = pd.read_csv(
+            atlas_utils.get_file_path("connectivity_matrices/mean80_fiberlength.csv"),
+            header=None,
+        ).values.astype(float)
+
+    return (
+        pd.DataFrame(counts, index=regions, columns=regions, copy=False),
+        pd.DataFrame(lengths, index=regions, columns=regions, copy=False),
+    )
+
+
+def _connectome_hash(lengths, edges):
+    digest = hashlib.sha1()
+    digest.update(str((lengths.shape, lengths.dtype.str)).encode())
+    digest.update(np.ascontiguousarray(lengths).data)
+    digest.update(np.packbits(edges).data)
+    return digest.hexdigest()
+
+
+def _single_paths(lengths, edges):
+    """Cached (shortest path length, hop count) matrices of one connectome."""
+    key = _connectome_hash(lengths, edges)
+    paths = _paths_cache.get(key)
+    if paths is not None:
+        return paths
+
+    rows, cols = np.nonzero(edges)
+    graph = sparse.csr_matrix(
+        (lengths[rows, cols].astype(float), (rows, cols)), shape=lengths.shape
+    )
+    paths = (
+        csgraph.shortest_path(graph, method="D", directed=False),
+        csgraph.shortest_path(graph, method="D", directed=False, unweighted=True),
+    )
+    for array in paths:
+        array.flags.writeable = False
+
+    _paths_cache.put(key, paths)
+    return paths
+
+
+def _path_inputs(lengths, weights):
+    if isinstance(lengths, pd.DataFrame):
+        lengths = lengths.values
+    lengths = np.asarray(lengths)
+    if weights is None:
+        edges = (lengths > 0) & np.isfinite(lengths)
+    else:
+        if isinstance(weights, pd.DataFrame):
+            weights = weights.values
+        edges = np.broadcast_to(np.asarray(weights) != 0, lengths.shape)
+    return lengths, edges
+
+
+def shortest_paths(lengths, weights=None):
+    """Weighted shortest-path lengths and hop counts of tract-length graphs.
+
+    Paths are computed with `scipy.sparse.csgraph` (Dijkstra) and cached
+    per connectome (keyed by a hash of its content), so models calling this
+    repeatedly, e.g. inside an optimizer loop, pay for it once.
+
+    Args:
+        lengths (np.ndarray or pd.DataFrame): (R, R) or (N, R, R) symmetric
+            tract lengths, e.g. `load_fiber_matrices()[1]`.
+        weights (np.ndarray or pd.DataFrame, optional): connectomes whose
+            non-zero entries define the edges (e.g. fiber counts), same
+            shape or (R, R) for all subjects. Defaults to positive lengths.
+
+    Returns:
+        dict: "length" (path lengths) and "hops" (number of edges of the
+        fewest-edges path), both (..., R, R) float arrays, np.inf between
+        disconnected regions. Single-matrix results are read-only since
+        they are shared through the cache.
+
+    """
+    lengths, edges = _path_inputs(lengths, weights)
+    if lengths.ndim == 2:
+        path_lengths, hops = _single_paths(lengths, edges)
+        return {"length": path_lengths, "hops": hops}
+
+    paths = [_single_paths(L, E) for L, E in zip(lengths, edges)]
+    return {
+        "length": np.stack([path_lengths for path_lengths, _ in paths]),
+        "hops": np.stack([hops for _, hops in paths]),
+    }
+
+
+def conduction_delays(lengths, velocities, weights=None, direct=False):
+    """Conduction delays (length / velocity) for several velocities at once.
+
+    With lengths in mm and velocities in m/s, delays are in ms.
+
+    Args:
+        lengths, weights: see `shortest_paths`.
+        velocities (float or array): (V,) conduction velocities.
+        direct (bool): delays of the direct tracts only (0 where there is no
+            tract) instead of along the shortest paths.
+
+    Returns:
+        np.ndarray: (V, ..., R, R) delays (without the V axis for a scalar
+        velocity).
+
+    """
+    if direct:
+        lengths, edges = _path_inputs(lengths, weights)
+        path_lengths = np.where(edges, lengths, 0).astype(float)
+    else:
+        path_lengths = shortest_paths(lengths, weights)["length"]
+
+    velocities = np.asarray(velocities, dtype=float)
+    return path_lengths / velocities.reshape(
+        velocities.shape + (1,) * path_lengths.ndim
+    )
+
+
+def cache_clear():
+    """Empty the shortest-path cache."""
+    _paths_cache.clear()
+
+
+def cache_info():
+    """Shortest-path cache statistics.
+
+    Returns:
+        dict: "hits" and "misses" counts, plus "currsize" and "maxsize".
+
+    """
+    return _paths_cache.info()
@@ -1,12 +1,14 @@
 import itertools
 import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
+
+# matplotlib is imported inside the plotting functions, so that the counting
+# helpers can be used without loading it.
 
 
 def plot_confusion_matrix(
-    cm, classes, title="Confusion matrix", cmap=plt.cm.Blues, save=False, save_name="cm"
+    cm, classes, title="Confusion matrix", cmap="Blues", save=False, save_name="cm"
 ):
+    import matplotlib.pyplot as plt
 
     plt.imshow(cm, interpolation="nearest", cmap=cmap)
     plt.title(title)
@@ -33,73 +35,81 @@ def plot_confusion_matrix(
         plt.savefig("../images/" + str(save_name) + ".pdf", format="pdf")
 
 
-def calculate_group_distributions(labels_dict, true_labels, num_clusters):
+def group_contingency(cluster_labels, true_labels, num_clusters, num_groups=None):
+    """
+    Count individuals of each true group in each cluster, for many
+    clusterings at once (e.g. variables or bootstrap resamples).
+    cluster_labels (array): (..., n) cluster label of each individual, one row
+      per clustering. Labels outside [0, num_clusters) are ignored.
+    true_labels (array): (n,) group label (0, 1, ...) of each individual, or
+      (..., n) labels broadcast against cluster_labels (e.g. permutations).
+      Labels outside [0, num_groups) are ignored.
+    num_clusters (int): number of clusters
+    num_groups (int): number of groups. Defaults to max(true_labels) + 1.
+    returns (np.ndarray): (..., num_clusters, num_groups) contingency tensor,
+      computed with a single np.bincount over the encoded label pairs
+    """
+    true_labels = np.asarray(true_labels, dtype=int)
+    if num_groups is None:
+        num_groups = int(true_labels.max()) + 1
+    cluster_labels, true_labels = np.broadcast_arrays(
+        np.asarray(cluster_labels), true_labels
+    )
+
+    lead_shape = cluster_labels.shape[:-1]
+    cluster_labels = cluster_labels.reshape(-1, cluster_labels.shape[-1])
+    true_labels = true_labels.reshape(cluster_labels.shape)
+    num_tables = len(cluster_labels)
+
+    table_index = np.arange(num_tables)[:, None]
+    codes = (table_index * num_clusters + cluster_labels) * num_groups + true_labels
+    valid = (cluster_labels >= 0) & (cluster_labels < num_clusters)
+    valid &= (true_labels >= 0) & (true_labels < num_groups)
+
+    counts = np.bincount(
+        codes[valid].astype(int), minlength=num_tables * num_clusters * num_groups
+    )
+    return counts.reshape(lead_shape + (num_clusters, num_groups))
+
+
+def calculate_group_distributions(
+    labels_dict, true_labels, num_clusters, num_groups=None
+):
     """
     Calculate distribution of true labels (e.g. G1,G2,G3) in each cluster in labels_dict
     labels_dict (dict): indices of individuals in each cluster
     true_labels (list): list of labels for each individual
     num_clusters (int): number of clusters in labels_dict
+    num_groups (int): number of true groups. Defaults to max(true_labels) + 1.
+    returns (dict): {var: {'c0': [count of group 0, count of group 1, ...], ...}}
     """
+    variables = list(labels_dict.keys())
+    # variables x clusters x groups, e.g. ('apib', 'atrophy', tau) x c x G
+    tally = group_contingency(
+        np.array([labels_dict[var] for var in variables]),
+        true_labels,
+        num_clusters,
+        num_groups,
+    )
 
-    patients_by_cluster = {
-        k: {"c" + str(c): np.where(labels_dict[k] == c)[0] for c in range(num_clusters)}
-        for k in labels_dict.keys()
+    return {
+        var: {"c" + str(c): tally[v, c].tolist() for c in range(num_clusters)}
+        for v, var in enumerate(variables)
     }
 
-    group_dist = {}
-    for var in patients_by_cluster.keys():
-        # var = 'apib', 'atrophy', tau
-        cluster_tally = {}
-        for cluster, patients in patients_by_cluster[var].items():  # loop over clusters
-            cluster_dist = []
-            for patient in patients:
-                patient_group = true_labels[patient]
-                cluster_dist.append(patient_group)
-            tally = np.unique(np.array(cluster_dist), return_counts=True)
-            cluster_tally.update({cluster: tally})
-
-        group_dist.update({var: cluster_tally})
-
-    def make_plot_ready_distributions(group_dist):
-        """
-        transform a 'unique' type array (e.g. (array([2,3]), array([1,6])))
-        into a count of fixed length (e.g. [0,1,6])
-        """
-        dist = {}
-        for var in group_dist.keys():  # loop over variables (apib, atrophy, tau)
-            cluster_dist = {}
-            for cluster, unique_dist in group_dist[var].items():  # loop over clusters
-                dist_in_cluster = []
-                for group in range(3):  # loop over the 3 groups
-                    # find where the group is represented in the cluster
-                    location_group_G_in_cluster = np.where(unique_dist[0] == group)[0]
-
-                    if (
-                        location_group_G_in_cluster.size == 0
-                    ):  # if group not represented, add 0
-                        dist_in_cluster.append(0)
-                    else:
-                        num_groups_g_in_cluster = unique_dist[1][
-                            location_group_G_in_cluster
-                        ][0]
-                        dist_in_cluster.append(num_groups_g_in_cluster)
-                cluster_dist.update({cluster: dist_in_cluster})
-            dist.update({var: cluster_dist})
-        return dist
-
-    return make_plot_ready_distributions(group_dist)
-
 
 def plot_all_classes_dist(
     labels_dict, true_labels, num_clusters, save=False, save_name="temp"
 ):
-    distributions = calculate_group_distributions(
-        labels_dict, true_labels, num_clusters
-    )
+    import matplotlib.pyplot as plt
 
     NUM_VARS = 3  # apib, atrophy, tau
     NUM_GROUPS = 3  # G1, G2, G3
 
+    distributions = calculate_group_distributions(
+        labels_dict, true_labels, num_clusters, NUM_GROUPS
+    )
+
     fig_dim = (20, 20)
     fig, axes = plt.subplots(NUM_VARS, num_clusters, figsize=fig_dim)
     xticks = np.arange(NUM_GROUPS)
@@ -127,42 +137,295 @@ def plot_all_classes_dist(
     plt.show()
 
 
+def _comb2(x):
+    return x * (x - 1) / 2.0
+
+
+def _adjusted_rand_index(tables):
+    """Adjusted Rand index of (..., K, G) contingency tables."""
+    total = tables.sum(axis=(-2, -1))
+    index = _comb2(tables).sum(axis=(-2, -1))
+    rows = _comb2(tables.sum(axis=-1)).sum(axis=-1)
+    columns = _comb2(tables.sum(axis=-2)).sum(axis=-1)
+    expected = rows * columns / _comb2(total)
+    maximum = (rows + columns) / 2.0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(
+            maximum == expected, 1.0, (index - expected) / (maximum - expected)
+        )
+
+
+def _chi2_statistic(tables):
+    """Pearson chi-squared statistic of (..., K, G) contingency tables."""
+    total = tables.sum(axis=(-2, -1))[..., None, None]
+    expected = (
+        tables.sum(axis=-1, keepdims=True) * tables.sum(axis=-2, keepdims=True) / total
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        terms = (tables - expected) ** 2 / expected
+    return np.where(expected > 0, terms, 0.0).sum(axis=(-2, -1))
+
+
+ASSOCIATION_STATISTICS = {"chi2": _chi2_statistic, "ari": _adjusted_rand_index}
+
+
+def relabel_clusters(contingency):
+    """
+    Optimally assign clusters to classes (Hungarian algorithm,
+    scipy.optimize.linear_sum_assignment) for a stack of contingency tables,
+    e.g. the output of group_contingency.
+    contingency (array): (..., K, G) counts of true group g in cluster k.
+      Rectangular tables are zero-padded to square for the assignment.
+    returns (dict):
+      'confusion_matrix': (..., G, G) true class x predicted class counts
+        (individuals of clusters left unassigned when K > G are dropped)
+      'assignment': (..., G) cluster assigned to each class (>= K, i.e. an
+        empty cluster, when K < G)
+      'accuracy': (...,) fraction of individuals on the diagonal
+      'ari': (...,) adjusted Rand index of clusters vs. true groups
+    """
+    from scipy.optimize import linear_sum_assignment
+
+    contingency = np.asarray(contingency)
+    lead_shape = contingency.shape[:-2]
+    num_clusters, num_groups = contingency.shape[-2:]
+    size = max(num_clusters, num_groups)
+
+    tables = np.zeros((int(np.prod(lead_shape)), size, size), dtype=contingency.dtype)
+    tables[:, :num_clusters, :num_groups] = contingency.reshape(
+        -1, num_clusters, num_groups
+    )
+
+    # maximize matched counts: class g <- cluster assignment[g]
+    assignment = np.empty((len(tables), size), dtype=int)
+    for b, table in enumerate(tables):
+        clusters, classes = linear_sum_assignment(table, maximize=True)
+        assignment[b, classes] = clusters
+
+    # cm[b, true, predicted] = tables[b, assignment[b, predicted], true]
+    batch = np.arange(len(tables))[:, None]
+    confusion_matrix = tables[batch, assignment].transpose(0, 2, 1)
+
+    total = tables.sum(axis=(1, 2))
+    accuracy = np.trace(confusion_matrix, axis1=1, axis2=2) / total
+    ari = _adjusted_rand_index(tables)
+
+    # crop the padding: phantom classes (K > G) and their clusters
+    confusion_matrix = confusion_matrix[:, :num_groups, :num_groups]
+    return {
+        "confusion_matrix": confusion_matrix.reshape(
+            lead_shape + (num_groups, num_groups)
+        ),
+        "assignment": assignment[:, :num_groups].reshape(lead_shape + (num_groups,)),
+        "accuracy": accuracy.reshape(lead_shape),
+        "ari": ari.reshape(lead_shape),
+    }
+
+
 def make_cm_from_group_dist(group_dist_dict, num_classes):
     """
     Given a group distribution for a class
     e.g. {{'c0': [5, 14, 14], 'c1': [12, 2, 12], 'c2': [1, 1, 24]}}
-    redistribute them as G1', G2', G3' according to the majority
+    redistribute them as G1', G2', G3' with the cluster -> class assignment
+    that maximizes the number of correctly labeled individuals
+    (see relabel_clusters)
     """
-    import pandas as pd
+    variables = list(group_dist_dict.keys())
+    # variables x clusters x groups
+    contingency = np.array(
+        [
+            [group_dist_dict[var][cluster] for cluster in group_dist_dict[var]]
+            for var in variables
+        ]
+    )
+    cms = relabel_clusters(contingency[:, :, :num_classes])["confusion_matrix"]
+
+    return {var: cms[v] for v, var in enumerate(variables)}
 
-    cm_dic = {}
-    for var in group_dist_dict.keys():
 
-        confusion_matrix = []
-        # turn dict into pandas DataFrame
-        df = pd.DataFrame(group_dist_dict[var])
-        # find max value for each row (true label) and assign it as new label
-        for n in reversed(range(num_classes)):
-            old_class = df.iloc[n].idxmax()  # calculate max
-            new_class = list(df[old_class])
-            confusion_matrix.insert(0, new_class)  # append to confusion matrix
-            df = df.drop(old_class, axis=1)  # remove this column from df
-        cm = np.transpose(np.array(confusion_matrix))
-        cm_dic.update({var: cm})
+def _association_chunk(
+    kind, cluster_labels, true_labels, num_clusters, num_groups, statistic, size, seed
+):
+    """Association statistic of `size` permuted or bootstrapped samples.
+
+    All resampled contingency tables of the chunk come from one bincount.
+    Module-level so that it can run in a process pool.
+    """
+    # RandomState rather than Generator: environment.yml pins numpy 1.16
+    rng = np.random.RandomState(seed)
+    num_individuals = true_labels.shape[-1]
+
+    if kind == "permutation":
+        # shuffle the true groups independently for every sample
+        permutations = np.argsort(rng.rand(size, num_individuals), axis=1)
+        groups = true_labels[permutations]
+        clusters = cluster_labels[None]
+    else:
+        # resample individuals with replacement
+        samples = rng.randint(0, num_individuals, (size, num_individuals))
+        groups = true_labels[samples]
+        clusters = cluster_labels[:, samples].transpose(1, 0, 2)
+
+    tables = group_contingency(clusters, groups[:, None], num_clusters, num_groups)
+    return ASSOCIATION_STATISTICS[statistic](tables)
+
+
+def _resampled_statistics(
+    kind,
+    cluster_labels,
+    true_labels,
+    num_clusters,
+    num_groups,
+    statistic,
+    num_samples,
+    chunk_size,
+    num_workers,
+    seed,
+):
+    """(num_samples, V) resampled statistics, computed in chunks of at most
+    `chunk_size` samples, optionally across `num_workers` processes."""
+    sizes = [chunk_size] * (num_samples // chunk_size)
+    if num_samples % chunk_size:
+        sizes.append(num_samples % chunk_size)
+    # one seeded stream per chunk: results do not depend on num_workers
+    seeds = np.random.RandomState(seed).randint(0, 2**31 - 1, len(sizes))
+    jobs = [
+        (kind, cluster_labels, true_labels, num_clusters, num_groups, statistic)
+        + (size, chunk_seed)
+        for size, chunk_seed in zip(sizes, seeds)
+    ]
+
+    if num_workers is None or num_workers <= 1:
+        chunks = [_association_chunk(*job) for job in jobs]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(num_workers) as pool:
+            chunks = list(pool.map(_association_chunk, *zip(*jobs)))
+
+    return np.concatenate(chunks)
+
+
+def _association_inputs(cluster_labels, true_labels, num_groups):
+    cluster_labels = np.atleast_2d(np.asarray(cluster_labels, dtype=int))
+    true_labels = np.asarray(true_labels, dtype=int)
+    if num_groups is None:
+        num_groups = int(true_labels.max()) + 1
+    return cluster_labels, true_labels, num_groups
+
+
+def permutation_test(
+    cluster_labels,
+    true_labels,
+    num_clusters,
+    num_groups=None,
+    statistic="chi2",
+    num_permutations=10000,
+    chunk_size=1000,
+    num_workers=None,
+    seed=None,
+):
+    """
+    Permutation test of the association between clusters and true groups
+    (e.g. spectral clusters vs. diagnosis), for several modalities at once.
+    The contingency tables of each chunk of permutations are built with a
+    single bincount over a (P, n) matrix of shuffled groups.
+    cluster_labels (array): (n,) or (V, n) cluster labels, one row per
+      modality (e.g. APIB, atrophy, tau)
+    true_labels (array): (n,) true group of each individual
+    num_clusters (int): number of clusters
+    num_groups (int): number of groups. Defaults to max(true_labels) + 1.
+    statistic (str): 'chi2' (Pearson chi-squared) or 'ari' (adjusted Rand)
+    num_permutations (int): number of shuffles of true_labels
+    chunk_size (int): permutations per chunk, bounds memory to about
+      chunk_size * V * n integers
+    num_workers (int): spread chunks over this many processes
+    seed (int): seed, results are reproducible for any num_workers
+    returns (dict):
+      'statistic': (V,) observed statistic
+      'null': (num_permutations, V) statistic under permutation
+      'p_value': (V,) one-sided permutation p-value
+    """
+    cluster_labels, true_labels, num_groups = _association_inputs(
+        cluster_labels, true_labels, num_groups
+    )
+    observed = ASSOCIATION_STATISTICS[statistic](
+        group_contingency(cluster_labels, true_labels, num_clusters, num_groups)
+    )
+    null = _resampled_statistics(
+        "permutation",
+        cluster_labels,
+        true_labels,
+        num_clusters,
+        num_groups,
+        statistic,
+        num_permutations,
+        chunk_size,
+        num_workers,
+        seed,
+    )
+    p_value = (1 + (null >= observed).sum(axis=0)) / (num_permutations + 1.0)
+
+    return {"statistic": observed, "null": null, "p_value": p_value}
+
+
+def bootstrap_association(
+    cluster_labels,
+    true_labels,
+    num_clusters,
+    num_groups=None,
+    statistic="ari",
+    num_resamples=1000,
+    confidence=95,
+    chunk_size=1000,
+    num_workers=None,
+    seed=None,
+):
+    """
+    Bootstrap distribution and confidence interval of the association
+    between clusters and true groups, resampling individuals with
+    replacement. Arguments as in permutation_test.
+    confidence (float): width of the percentile confidence interval, in %
+    returns (dict):
+      'statistic': (V,) observed statistic
+      'bootstrap': (num_resamples, V) statistic of each resample
+      'ci': (2, V) lower and upper confidence bounds
+    """
+    cluster_labels, true_labels, num_groups = _association_inputs(
+        cluster_labels, true_labels, num_groups
+    )
+    observed = ASSOCIATION_STATISTICS[statistic](
+        group_contingency(cluster_labels, true_labels, num_clusters, num_groups)
+    )
+    resampled = _resampled_statistics(
+        "bootstrap",
+        cluster_labels,
+        true_labels,
+        num_clusters,
+        num_groups,
+        statistic,
+        num_resamples,
+        chunk_size,
+        num_workers,
+        seed,
+    )
+    tail = (100 - confidence) / 2.0
+    ci = np.percentile(resampled, [tail, 100 - tail], axis=0)
 
-    return cm_dic
+    return {"statistic": observed, "bootstrap": resampled, "ci": ci}
 
 
 def plot_confusion_matrix(
     cm,
     class_names,
     title=["APIB", "Atrophy", "Tau"],
-    cmap=plt.cm.Reds,
+    cmap="Reds",
     save=False,
     save_name="cm",
 ):
+    import matplotlib.pyplot as plt
 
-    plt.imshow(cm, interpolation="nearest", cmap=plt.cm.Reds)
+    plt.imshow(cm, interpolation="nearest", cmap="Reds")
 
     plt.title(title, fontsize=24)
     tick_marks = np.arange(len(class_names))
@@ -189,10 +452,11 @@ def plot_confusion_matrices(
     cm_dic,
     class_names,
     title=["APIB", "Atrophy", "Tau"],
-    cmap=[plt.cm.Reds, plt.cm.Blues, plt.cm.Greens],
+    cmap=["Reds", "Blues", "Greens"],
     save=False,
     save_name="cm",
 ):
+    import matplotlib.pyplot as plt
 
     NUM_GROUPS = len(cm_dic.keys())
     fig_dim = (20, 10)
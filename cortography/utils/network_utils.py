@@ -0,0 +1,317 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse import linalg as splinalg
+
+from cortography.utils import store_utils
+
+EPS = float(np.finfo(float).eps)
+
+# in-memory eigendecompositions kept by `laplacian_eigenmodes`
+CACHE_SIZE = 32
+# directory of the on-disk tier shared by worker processes (None: memory only)
+CACHE_DIR = None
+
+_eigenmodes_cache = store_utils._LRUCache(
+    CACHE_SIZE, stats=("hits", "disk_hits", "misses")
+)
+
+
+def _degree_scalings(row, col, kind):
+    """Left/right scalings `a`, `b` of the normalized Laplacians
+    L = eye(nroi) - diag(a) * C * diag(b). `b` is None when it is all ones."""
+    if kind == 1:
+        return 1.0 / (row + EPS), None
+    if kind == 2:
+        return 1.0 / (np.sqrt(row) + EPS), 1.0 / (np.sqrt(col) + EPS)
+    if kind == 3:
+        return 1.0 / (np.sqrt(row * col) + EPS), None
+    if kind == 4:
+        scale = 1.0 / np.sqrt(np.sqrt(row * col) + EPS)
+        return scale, scale
+    if kind == 5:
+        return 1.0 / (np.sqrt((row + col) / 2) + EPS), None
+    raise ValueError("Laplacian kind must be an integer between 0 and 5.")
+
+
+def compute_laplacian(C, kind=0):
+    """Compute a graph Laplacian from a connectivity matrix.
+
+    Uses the normalizations of `atlas_utils.load_laplacian` (from Ashish Raj),
+    with rowdegree = sum(C, 2) and coldegree = sum(C, 1):
+        kind=0: L0 = diag(rowdegree) - C;
+        kind=1: L1 = eye(nroi) - diag(1./(rowdegree+eps)) * C;
+        kind=2: L2 = eye(nroi) - diag(1./(sqrt(rowdegree)+eps)) * C* diag(1./(sqrt(coldegree)+eps)) ;
+        kind=3: L3 = eye(nroi) - diag(1./(sqrt(rowdegree.*coldegree)+eps)) * C;
+        kind=4: L4 = eye(nroi) - diag(1./(sqrt(sqrt(rowdegree.*coldegree)+eps))) * C * diag(1./(sqrt(sqrt(rowdegree.*coldegree)+eps)));
+        kind=5: L5 = eye(nroi) - diag(1./(sqrt((rowdegree+coldegree)/2)+eps)) * C;
+
+    Applied to the bundled DK connectome (`dk_connectivity.mat`) this gives
+    the matrices stored in `laplacians.mat`, position by position only:
+    `atlas_utils.load_connectivity()` labels its rows in RLLR order while
+    `atlas_utils.load_laplacian()` labels the same positions in LRRL order,
+    so `compute_laplacian(load_connectivity())` and `load_laplacian()` do
+    not match when aligned by region name. Compare the `.values` instead.
+
+    Args:
+        C (np.ndarray, pd.DataFrame or scipy.sparse matrix): connectivity,
+            either one (R, R) matrix or a stacked (N, R, R) cohort (dense only).
+        kind (int): normalization, 0 to 5.
+
+    Returns:
+        Laplacian of the same shape and type as `C` (DataFrames keep their
+        labels, sparse input gives a CSR matrix, float32 stays float32).
+
+    """
+    if isinstance(C, pd.DataFrame):
+        return pd.DataFrame(
+            compute_laplacian(C.values, kind), index=C.index, columns=C.columns
+        )
+
+    if sparse.issparse(C):
+        C = sparse.csr_matrix(C)
+        row = np.asarray(C.sum(axis=1)).ravel()
+        col = np.asarray(C.sum(axis=0)).ravel()
+        if kind == 0:
+            return sparse.csr_matrix(sparse.diags(row) - C)
+        a, b = _degree_scalings(row, col, kind)
+        scaled = sparse.diags(a).dot(C)
+        if b is not None:
+            scaled = scaled.dot(sparse.diags(b))
+        return sparse.csr_matrix(sparse.identity(C.shape[0], format="csr") - scaled)
+
+    C = np.asarray(C)
+    if not np.issubdtype(C.dtype, np.floating):
+        C = C.astype(float)
+    row = C.sum(axis=-1)
+    col = C.sum(axis=-2)
+    diagonal = np.arange(C.shape[-1])
+
+    if kind == 0:
+        L = -C
+        L[..., diagonal, diagonal] += row
+        return L
+
+    a, b = _degree_scalings(row, col, kind)
+    L = C * a[..., :, None]
+    if b is not None:
+        L *= b[..., None, :]
+    L = -L
+    L[..., diagonal, diagonal] += 1
+    return L.astype(C.dtype, copy=False)
+
+
+def _content_hash(L, k, which):
+    """Hash of a Laplacian's content (which includes its normalization)."""
+    digest = hashlib.sha1()
+    if sparse.issparse(L):
+        L = sparse.csr_matrix(L)
+        L.sum_duplicates()
+        arrays = [L.data, L.indices, L.indptr]
+        digest.update(b"sparse")
+    else:
+        arrays = [np.ascontiguousarray(L)]
+    digest.update(str((L.shape, L.dtype.str, k, which)).encode())
+    for array in arrays:
+        digest.update(np.ascontiguousarray(array).data)
+    return digest.hexdigest()
+
+
+def _is_symmetric(L):
+    if sparse.issparse(L):
+        return abs(L - L.T).max() <= 1e-10 * max(abs(L).max(), 1)
+    return np.allclose(L, L.T, rtol=0, atol=1e-10 * max(np.abs(L).max(), 1))
+
+
+def _eigendecomposition(L, k, which):
+    """Eigenvalues (ascending) and eigenvectors (columns) of `L`."""
+    symmetric = _is_symmetric(L)
+
+    if k is None:
+        L = L.toarray() if sparse.issparse(L) else np.asarray(L)
+        if symmetric:
+            evals, evecs = np.linalg.eigh(L)
+        else:
+            evals, evecs = np.linalg.eig(L)
+            evals, evecs = evals.real, evecs.real
+    elif symmetric:
+        evals, evecs = splinalg.eigsh(L, k=k, which=which)
+    else:
+        which = {"SA": "SR", "LA": "LR"}.get(which, which)
+        evals, evecs = splinalg.eigs(L, k=k, which=which)
+        evals, evecs = evals.real, evecs.real
+
+    order = np.argsort(evals)
+    return evals[order], np.ascontiguousarray(evecs[:, order])
+
+
+def laplacian_eigenmodes(L, k=None, which="SA", cache_dir=None):
+    """Eigendecomposition of a Laplacian, cached by content.
+
+    Decompositions are keyed by a hash of the Laplacian values (and so of its
+    normalization) and kept in an in-memory LRU of CACHE_SIZE entries. With a
+    `cache_dir` (or CACHE_DIR) they are also stored there as .npy files and
+    memory-mapped back, so repeated runs and parallel workers share a single
+    decomposition.
+
+    Args:
+        L (np.ndarray, pd.DataFrame or scipy.sparse matrix): (R, R) Laplacian,
+            e.g. from `atlas_utils.load_laplacian` or `compute_laplacian`.
+        k (int, optional): number of eigenmodes for a truncated decomposition
+            with `scipy.sparse.linalg.eigsh` (`eigs` for non-symmetric L),
+            for high-resolution parcellations. Defaults to all R modes.
+        which (str): eigenmodes kept when `k` is given: "SA" (smallest, the
+            slow diffusion modes) or "LA" (largest).
+        cache_dir (str, optional): directory of the on-disk cache.
+
+    Returns:
+        evals (np.ndarray): (k,) eigenvalues in ascending order.
+        evecs (np.ndarray): (R, k) eigenvectors, one per column.
+        Both arrays are read-only since they are shared through the cache.
+
+    """
+    if isinstance(L, pd.DataFrame):
+        L = L.values
+    key = _content_hash(L, k, which)
+
+    modes = _eigenmodes_cache.get(key)
+    if modes is not None:
+        return modes
+
+    cache_dir = cache_dir if cache_dir is not None else CACHE_DIR
+    stat = "misses"
+    if cache_dir is not None:
+        paths = [
+            os.path.join(cache_dir, key + suffix)
+            for suffix in ("_evals.npy", "_evecs.npy")
+        ]
+        if all(os.path.exists(path) for path in paths):
+            modes = tuple(np.load(path, mmap_mode="r") for path in paths)
+            stat = "disk_hits"
+
+    if modes is None:
+        modes = _eigendecomposition(L, k, which)
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            for path, array in zip(paths, modes):
+                store_utils._save_atomic(path, array)
+        for array in modes:
+            array.flags.writeable = False
+
+    _eigenmodes_cache.put(key, modes, stat)
+    return modes
+
+
+def cache_clear():
+    """Empty the in-memory eigenmode cache (files in the cache dir are kept)."""
+    _eigenmodes_cache.clear()
+
+
+def cache_info():
+    """Eigenmode cache statistics.
+
+    Returns:
+        dict: "hits", "disk_hits" and "misses" counts, plus "currsize" and
+        "maxsize" of the in-memory cache.
+
+    """
+    return _eigenmodes_cache.info()
+
+
+def _ndm_basis(L):
+    """Eigenbasis of x(t) = expm(-beta * L * t) * x0: eigenvalues,
+    eigenvectors and their inverse."""
+    if isinstance(L, pd.DataFrame):
+        L = L.values
+    evals, evecs = laplacian_eigenmodes(L)
+    if _is_symmetric(L):
+        inverse = evecs.T
+    else:
+        inverse = np.linalg.inv(evecs)
+    return evals, evecs, inverse
+
+
+def _ndm_decay(evals, beta, times):
+    """One diagonal exponential per (beta, time) pair: (B, T, R)."""
+    rates = beta.reshape(-1, 1, 1) * times.reshape(1, -1, 1)
+    return np.exp(-rates * evals.reshape(1, 1, -1))
+
+
+def simulate_ndm(L, seeds, times, beta=1.0):
+    """Network diffusion model x(t) = expm(-beta * L * t) * x0.
+
+    All seed vectors, time points and beta values are simulated at once in
+    the eigenbasis of L: one diagonal exponential per (beta, time) pair and a
+    few batched matrix products, instead of one `expm` per call. The
+    eigendecomposition comes from the `laplacian_eigenmodes` cache.
+
+    Args:
+        L (np.ndarray or pd.DataFrame): (R, R) Laplacian, e.g. from
+            `atlas_utils.load_laplacian`.
+        seeds (np.ndarray): initial conditions x0, (R,) or (S, R).
+        times (float or array): time point(s), shape (T,).
+        beta (float or array): diffusivity value(s), shape (B,).
+
+    Returns:
+        np.ndarray: x(t) of shape beta.shape + times.shape + seeds.shape,
+        e.g. (B, T, S, R).
+
+    """
+    evals, evecs, inverse = _ndm_basis(L)
+    beta = np.asarray(beta, dtype=float)
+    times = np.asarray(times, dtype=float)
+    decay = _ndm_decay(evals, beta, times)
+    grid_shape = beta.shape + times.shape
+    seeds = np.asarray(seeds, dtype=float)
+
+    projected = seeds.reshape(-1, seeds.shape[-1]).dot(inverse.T)
+    x = np.matmul(projected * decay[:, :, None, :], evecs.T)
+
+    return x.reshape(grid_shape + seeds.shape)
+
+
+def simulate_ndm_chunks(
+    L, seeds, times, beta=1.0, chunk_size=1000, time_chunk_size=None
+):
+    """Stream `simulate_ndm` results over blocks of seed vectors and times.
+
+    Each block holds at most B x `time_chunk_size` x `chunk_size` x R
+    values, and its exponentials are computed only for its own times, so
+    memory stays bounded for very large seed x time x beta grids.
+
+    Args:
+        L, seeds, times, beta: see `simulate_ndm`; `seeds` is (S, R).
+        chunk_size (int): number of seed vectors per block.
+        time_chunk_size (int, optional): number of time points per block.
+            Defaults to all of them.
+
+    Yields:
+        start (int): index of the first seed in the block.
+        time_start (int): index of the first time point in the block.
+        x (np.ndarray): block of shape beta.shape + (t,) + (n, R), or
+            beta.shape + (n, R) for a scalar `times`.
+
+    """
+    evals, evecs, inverse = _ndm_basis(L)
+    beta = np.asarray(beta, dtype=float)
+    times = np.asarray(times, dtype=float)
+    num_times = times.size
+    if time_chunk_size is None:
+        time_chunk_size = max(num_times, 1)
+
+    for start in range(0, len(seeds), chunk_size):
+        block = np.asarray(seeds[start : start + chunk_size], dtype=float)
+        projected = block.dot(inverse.T)
+        for time_start in range(0, num_times, time_chunk_size):
+            if times.ndim:
+                block_times = times[time_start : time_start + time_chunk_size]
+            else:
+                block_times = times
+            decay = _ndm_decay(evals, beta, block_times)
+            x = np.matmul(projected * decay[:, :, None, :], evecs.T)
+            yield start, time_start, x.reshape(
+                beta.shape + block_times.shape + block.shape
+            )
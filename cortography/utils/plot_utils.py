@@ -5,10 +5,10 @@ Created on 2019-08-22 09:37:36
 """
 
 #  This script registers the "turbo" colormap to matplotlib, and the reversed version as "turbo_r"
+#  Registration happens on demand with register_turbo(), so importing this module does not load matplotlib
 #  Reference:  https://ai.googleblog.com/2019/08/turbo-improved-rainbow-colormap-for.html
 
 import numpy as np
-import matplotlib.pyplot as plt
 
 turbo_colormap_data = np.array(
                        [[0.18995,0.07176,0.23217],
@@ -291,15 +291,41 @@ def RGBToPyCmap(rgbdata):
     return mpl_data
 
 
-mpl_data = RGBToPyCmap(turbo_colormap_data)
-plt.register_cmap(name='turbo', data=mpl_data, lut=turbo_colormap_data.shape[0])
+def register_turbo():
+    """Register "turbo" and "turbo_r" with matplotlib, unless already there
+    (matplotlib >= 3.4 ships its own "turbo")."""
+    import matplotlib
+    import matplotlib.cm
+    from matplotlib.colors import LinearSegmentedColormap
 
-mpl_data_r = RGBToPyCmap(turbo_colormap_data[::-1,:])
-plt.register_cmap(name='turbo_r', data=mpl_data_r, lut=turbo_colormap_data.shape[0])
+    lut = turbo_colormap_data.shape[0]
+    for name, rgbdata in [('turbo', turbo_colormap_data),
+                          ('turbo_r', turbo_colormap_data[::-1,:])]:
+        cmap = LinearSegmentedColormap(name, RGBToPyCmap(rgbdata), lut)
+        if not hasattr(matplotlib, 'colormaps'):  # matplotlib < 3.5
+            matplotlib.cm.register_cmap(name=name, cmap=cmap)
+        elif name not in matplotlib.colormaps:
+            matplotlib.colormaps.register(cmap, name=name)
+
+
+def get_colormap(cmap):
+    """Colormap registered as `cmap` (a Colormap is returned as is), on any
+    matplotlib 3 (`matplotlib.colormaps` only exists from 3.5)."""
+    import matplotlib
+    import matplotlib.cm
+
+    if not isinstance(cmap, str):
+        return cmap
+    if not hasattr(matplotlib, 'colormaps'):  # matplotlib < 3.5
+        return matplotlib.cm.get_cmap(cmap)
+    return matplotlib.colormaps[cmap]
 
 
 
 if __name__=='__main__':
+    import matplotlib.pyplot as plt
+
+    register_turbo()
 
     XX, YY = np.meshgrid(np.linspace(0,1,100), np.linspace(0,1,100))
     ZZ = np.sqrt(XX**2 + YY**2)
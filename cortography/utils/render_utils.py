@@ -0,0 +1,382 @@
+import os
+
+import numpy as np
+
+from cortography.utils import plot_utils
+
+# Headless, object-oriented rendering: figures are built with matplotlib's
+# Figure/Agg classes only, pyplot and its global state are never touched.
+# matplotlib is imported inside the functions (see ml_utils).
+
+GROUP_COLORS = ["red", "green", "blue"]
+
+# per-process figure templates, keyed by figure kind and layout
+_TEMPLATES = {}
+
+
+def _new_figure(figsize):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+class _MatrixPanels:
+    """Figure with one annotated matrix image per panel (confusion matrices).
+
+    The image and cell annotations are created once and updated in place for
+    every spec with the same layout.
+    """
+
+    def __init__(self, num_panels, size, figsize, fontsize):
+        self.fig = _new_figure(figsize)
+        axes = self.fig.subplots(1, num_panels, squeeze=False)[0]
+        self.panels = []
+        for ax in axes:
+            ax.tick_params(labelsize=fontsize)
+            image = ax.imshow(np.zeros((size, size)), interpolation="nearest")
+            ax.set_xticks(np.arange(size))
+            ax.set_yticks(np.arange(size))
+            texts = [
+                [
+                    ax.text(
+                        jj,
+                        ii,
+                        "",
+                        fontsize=fontsize,
+                        verticalalignment="center",
+                        horizontalalignment="center",
+                    )
+                    for jj in range(size)
+                ]
+                for ii in range(size)
+            ]
+            self.panels.append((ax, image, texts))
+        self.fontsize = fontsize
+        self.laid_out = False
+
+    def draw(self, cms, class_names, titles, cmaps, fmt):
+        # every panel is redrawn, none may keep a previous spec's matrix
+        if not len(cms) == len(titles) == len(cmaps) == len(self.panels):
+            raise ValueError(
+                "Got {} matrices, {} titles and {} colormaps for {} panels.".format(
+                    len(cms), len(titles), len(cmaps), len(self.panels)
+                )
+            )
+        for (ax, image, texts), cm, title, cmap in zip(self.panels, cms, titles, cmaps):
+            cm = np.asarray(cm)
+            image.set_data(cm)
+            image.set_cmap(cmap)
+            image.set_clim(cm.min(), cm.max())
+            ax.set_title(title, fontsize=self.fontsize)
+            ax.set_xticklabels(class_names, rotation=45)
+            ax.set_yticklabels(class_names)
+
+            thresh = cm.max() / 2.0
+            for ii, row in enumerate(texts):
+                for jj, text in enumerate(row):
+                    text.set_text(format(cm[ii, jj], fmt))
+                    text.set_color("white" if cm[ii, jj] > thresh else "black")
+        if not self.laid_out:
+            self.fig.tight_layout()
+            self.laid_out = True
+
+
+class _DistributionPanels:
+    """Grid of bar charts: variables x clusters, one bar per true group
+    (as in `ml_utils.plot_all_classes_dist`). Bars are updated in place."""
+
+    def __init__(self, num_vars, num_clusters, num_groups, figsize):
+        self.fig = _new_figure(figsize)
+        axes = self.fig.subplots(num_vars, num_clusters, squeeze=False)
+        colors = [GROUP_COLORS[g % len(GROUP_COLORS)] for g in range(num_groups)]
+        xticks = np.arange(num_groups)
+        self.panels = []
+        for ax in axes.ravel():
+            bars = ax.bar(xticks, np.zeros(num_groups), color=colors)
+            ax.set_xticks(xticks)
+            ax.set_xticklabels(["G-" + str(g + 1) for g in range(num_groups)])
+            ax.set_xlabel("Spectral Clusters")
+            ax.set_ylabel("Number of members in class")
+            self.panels.append((ax, bars))
+        self.laid_out = False
+
+    def draw(self, distributions, ymax):
+        panels = iter(self.panels)
+        for var, var_dist in distributions.items():
+            for cluster, dist in var_dist.items():
+                ax, bars = next(panels)
+                for bar, height in zip(bars, dist):
+                    bar.set_height(height)
+                ax.set_ylim(0, ymax)
+                ax.set_title(str(var) + "  " + str(cluster))
+        if not self.laid_out:
+            self.fig.tight_layout()
+            self.laid_out = True
+
+
+def _template(key, factory):
+    if key not in _TEMPLATES:
+        _TEMPLATES[key] = factory()
+    return _TEMPLATES[key]
+
+
+def _render(spec):
+    """Draw one figure spec on its (reused) template and return the figure."""
+    kind = spec["kind"]
+
+    if kind in ("confusion_matrix", "confusion_matrices"):
+        if kind == "confusion_matrix":
+            cms = [spec["cm"]]
+            titles = [spec.get("title", "")]
+            cmaps = [spec.get("cmap", "Reds")]
+            figsize = spec.get("figsize", (6, 6))
+        else:
+            cms = list(spec["cm_dic"].values())
+            titles = spec.get("title", ["APIB", "Atrophy", "Tau"])
+            cmaps = spec.get("cmap", ["Reds", "Blues", "Greens"])
+            figsize = spec.get("figsize", (20, 10))
+        size = len(spec["class_names"])
+        fontsize = spec.get("fontsize", 24)
+        template = _template(
+            (kind, len(cms), size, tuple(figsize), fontsize),
+            lambda: _MatrixPanels(len(cms), size, figsize, fontsize),
+        )
+        template.draw(cms, spec["class_names"], titles, cmaps, spec.get("fmt", "d"))
+
+    elif kind == "class_distributions":
+        distributions = spec["distributions"]
+        var_dists = list(distributions.values())
+        num_clusters = len(var_dists[0])
+        num_groups = len(next(iter(var_dists[0].values())))
+        figsize = spec.get("figsize", (20, 20))
+        template = _template(
+            (kind, len(var_dists), num_clusters, num_groups, tuple(figsize)),
+            lambda: _DistributionPanels(
+                len(var_dists), num_clusters, num_groups, figsize
+            ),
+        )
+        ymax = spec.get("ymax")
+        if ymax is None:
+            ymax = max(max(dist) for var in var_dists for dist in var.values()) + 1
+        template.draw(distributions, ymax)
+
+    else:
+        raise ValueError("Unknown figure kind: " + str(kind))
+
+    return template.fig
+
+
+def _render_batch(specs, output_dir, format, dpi):
+    paths = []
+    for spec in specs:
+        fig = _render(spec)
+        path = os.path.join(output_dir, spec["name"] + "." + format)
+        fig.savefig(path, format=format, dpi=dpi, transparent=spec.get("transparent"))
+        paths.append(path)
+    return paths
+
+
+def render_figures(specs, output_dir, format="png", dpi=100, num_workers=None):
+    """Render many confusion-matrix and class-distribution figures to files.
+
+    Figures are drawn headlessly with the Agg canvas, without pyplot. Each
+    process keeps one figure template per kind and layout and only updates
+    its data, annotations and titles between specs. With `num_workers`, the
+    specs are split in contiguous batches over a process pool.
+
+    Args:
+        specs (list of dict): figure specs. Every spec has a "name" (file
+            name without extension) and a "kind":
+            - "confusion_matrix": "cm", "class_names", optional "title",
+              "cmap" (as in `ml_utils.plot_confusion_matrix`);
+            - "confusion_matrices": "cm_dic", "class_names", optional "title"
+              and "cmap" lists (as in `ml_utils.plot_confusion_matrices`);
+            - "class_distributions": "distributions" from
+              `ml_utils.calculate_group_distributions`, optional "ymax".
+            Optional for all: "figsize", "fontsize", "fmt" (cell format,
+            default "d"), "transparent".
+        output_dir (str): directory where the files are written.
+        format (str): image format, e.g. "png" or "pdf".
+        dpi (int): resolution of raster formats.
+        num_workers (int, optional): number of processes.
+
+    Returns:
+        list of str: paths of the written files, in the order of `specs`.
+
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    specs = list(specs)
+
+    if num_workers is None or num_workers <= 1:
+        return _render_batch(specs, output_dir, format, dpi)
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    batch_size = -(-len(specs) // num_workers)
+    batches = [specs[i : i + batch_size] for i in range(0, len(specs), batch_size)]
+    with ProcessPoolExecutor(num_workers) as pool:
+        results = pool.map(
+            _render_batch,
+            batches,
+            [output_dir] * len(batches),
+            [format] * len(batches),
+            [dpi] * len(batches),
+        )
+        return [path for paths in results for path in paths]
+
+
+class _GlassBrain:
+    """Glass-brain projection background, drawn once per process. Subjects
+    only add (and later remove) their node markers on top of it."""
+
+    def __init__(self, display_mode, figsize):
+        from nilearn import plotting
+
+        self.fig = _new_figure(figsize)
+        self.display = plotting.plot_glass_brain(
+            None, display_mode=display_mode, figure=self.fig
+        )
+        self.axes = [display_ax.ax for display_ax in self.display.axes.values()]
+        self.background = [len(ax.collections) for ax in self.axes]
+
+    def draw(self, coords, color, size):
+        for ax, num_background in zip(self.axes, self.background):
+            for markers in ax.collections[num_background:]:
+                markers.remove()
+        self.display.add_markers(coords, marker_color=color, marker_size=size)
+
+
+def _node_colors(colors, cmap, vmin, vmax):
+    """RGBA node colors from values (mapped through `cmap`) or colors."""
+    colors = np.asarray(colors)
+    if colors.dtype.kind in "fiu" and colors.shape[-1:] not in [(3,), (4,)]:
+        from matplotlib.colors import Normalize
+
+        return plot_utils.get_colormap(cmap)(Normalize(vmin, vmax)(colors))
+    return colors
+
+
+def _render_glass_brain_batch(
+    coords,
+    colors,
+    sizes,
+    names,
+    output_dir,
+    cmap,
+    vmin,
+    vmax,
+    display_mode,
+    figsize,
+    dpi,
+):
+    template = _template(
+        ("glass_brain", display_mode, tuple(figsize)),
+        lambda: _GlassBrain(display_mode, figsize),
+    )
+    colors = _node_colors(colors, cmap, vmin, vmax)
+    sizes = np.asarray(sizes, dtype=float)
+    paths = []
+    for color, size, name in zip(colors, sizes, names):
+        template.draw(coords, color, size)
+        path = os.path.join(output_dir, name + ".png")
+        template.fig.savefig(path, dpi=dpi)
+        paths.append(path)
+    return paths
+
+
+def render_glass_brains(
+    coords,
+    colors,
+    sizes,
+    output_dir,
+    names=None,
+    cmap="viridis",
+    vmin=None,
+    vmax=None,
+    display_mode="lyrz",
+    figsize=(10, 3),
+    dpi=100,
+    num_workers=None,
+    chunk_size=100,
+):
+    """Render node-only glass brains for many subjects to PNG files.
+
+    Nodes are drawn as markers on a glass-brain background that is built
+    once per process, with no dummy edge matrix. Subjects are sent to the
+    workers in chunks of `chunk_size`, at most two chunks per worker at a
+    time, and their colors are mapped in the workers, so memory does not
+    grow with the number of subjects beyond the inputs themselves.
+
+    Args:
+        coords (np.ndarray): (R, 3) MNI coordinates of the nodes (e.g. the
+            DK centers of mass).
+        colors: per-subject node colors: (S, R) values mapped through `cmap`
+            between `vmin` and `vmax` (default: the range over all
+            subjects), or (S, R, 3|4) RGB(A) colors.
+        sizes: node sizes, (S, R) per subject, (R,) or a scalar for all.
+        output_dir (str): directory where the PNGs are written.
+        names (list of str, optional): file names (without extension) of
+            the subjects. Defaults to "glass_brain_<subject index>".
+        cmap (str): colormap for scalar `colors`.
+        vmin, vmax (float, optional): color range for scalar `colors`.
+        display_mode (str): nilearn glass-brain projections.
+        figsize (tuple): figure size in inches.
+        dpi (int): resolution.
+        num_workers (int, optional): number of processes.
+        chunk_size (int): subjects per worker task.
+
+    Returns:
+        list of str: paths of the written files, in subject order.
+
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    colors = np.asarray(colors)
+    num_subjects = len(colors)
+
+    if colors.dtype.kind in "fiu" and colors.shape[-1:] not in [(3,), (4,)]:
+        vmin = colors.min() if vmin is None else vmin
+        vmax = colors.max() if vmax is None else vmax
+    sizes = np.asarray(sizes)
+    if sizes.ndim < 2:
+        sizes = np.broadcast_to(sizes, (num_subjects, len(coords)))
+    if names is None:
+        names = ["glass_brain_" + str(subject) for subject in range(num_subjects)]
+
+    # chunks are sliced (and colors mapped, in the workers) only when needed
+    jobs = (
+        (
+            coords,
+            colors[start : start + chunk_size],
+            sizes[start : start + chunk_size],
+            names[start : start + chunk_size],
+            output_dir,
+            cmap,
+            vmin,
+            vmax,
+            display_mode,
+            figsize,
+            dpi,
+        )
+        for start in range(0, num_subjects, chunk_size)
+    )
+
+    if num_workers is None or num_workers <= 1:
+        results = [_render_glass_brain_batch(*job) for job in jobs]
+    else:
+        from collections import deque
+        from concurrent.futures import ProcessPoolExecutor
+
+        results = []
+        with ProcessPoolExecutor(num_workers) as pool:
+            # at most two chunks per worker in flight
+            pending = deque()
+            for job in jobs:
+                pending.append(pool.submit(_render_glass_brain_batch, *job))
+                if len(pending) >= 2 * num_workers:
+                    results.append(pending.popleft().result())
+            results.extend(future.result() for future in pending)
+
+    return [path for paths in results for path in paths]
@@ -0,0 +1,305 @@
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from scipy.io import loadmat
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../data/")
+# default location of the store written by `build_store`
+STORE_DIR = os.path.join(DATA_DIR, "store")
+MANIFEST = "manifest.json"
+CACHE_SIZE = 32
+
+
+def _data_path(filename):
+    return os.path.join(DATA_DIR, filename)
+
+
+def _mat(filename, key):
+    return loadmat(_data_path(filename))[key]
+
+
+def _matrix_csv(filename, **kwargs):
+    table = pd.read_csv(_data_path(filename), keep_default_na=False, **kwargs)
+    return table.values.astype(float), table
+
+
+def _save_atomic(path, array):
+    """np.save through a temporary file so concurrent readers never see a
+    partially written file (processes that mapped the previous file keep
+    reading it until they reopen `path`)."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".npy")
+    with os.fdopen(fd, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def _write_manifest(store_dir, manifest):
+    """Write `store_dir`/manifest.json atomically, so readers see either the
+    previous manifest or the complete new one."""
+    tmp_path = os.path.join(store_dir, MANIFEST + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, os.path.join(store_dir, MANIFEST))
+
+
+class _LRUCache:
+    """In-memory LRU of values keyed by content hash, for arrays that
+    `functools.lru_cache` cannot key (see `network_utils.laplacian_eigenmodes`
+    and `graph_utils.shortest_paths`).
+
+    `info` reports the counts of `stats` ("hits" are counted by `get`, the
+    others by `put`) plus "currsize" and "maxsize".
+    """
+
+    def __init__(self, maxsize, stats=("hits", "misses")):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.stats = dict.fromkeys(stats, 0)
+
+    def get(self, key):
+        """Cached value of `key` (now the most recently used), or None."""
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return self.entries[key]
+
+    def put(self, key, value, stat="misses"):
+        """Cache `value`, counting it in `stat`, and evict the least recently
+        used entry beyond `maxsize`."""
+        self.stats[stat] += 1
+        self.entries[key] = value
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.stats = dict.fromkeys(self.stats, 0)
+
+    def info(self):
+        info = dict(self.stats)
+        info.update({"currsize": len(self.entries), "maxsize": self.maxsize})
+        return info
+
+
+def _store_sources():
+    """Arrays of the store: name -> (source file, loader returning the
+    array and its metadata)."""
+    # imported here, atlas_utils itself reads from the store
+    from cortography.utils import atlas_utils
+
+    connectivity_regions = list(atlas_utils.load_connectivity().index)
+    laplacian_regions = list(atlas_utils.load_laplacian(0).index)
+
+    def mat_matrix(filename, key, regions=None):
+        def loader():
+            metadata = {} if regions is None else {"regions": regions}
+            return _mat(filename, key), metadata
+
+        return filename, loader
+
+    def laplacians():
+        fields = _mat("connectivity_matrices/laplacians.mat", "laplacians")[0][0]
+        metadata = {"regions": laplacian_regions, "axes": ["kind", "region", "region"]}
+        return np.stack([fields[n] for n in range(len(fields))]), metadata
+
+    def aal_connectivity():
+        S = _mat("connectivity_matrices/AAL_connectivity.mat", "S")
+        return np.moveaxis(S, -1, 0), {"axes": ["subject", "region", "region"]}
+
+    def rs_eeg(field):
+        def loader():
+            subjects = _mat("connectivity_matrices/rsEEG_TFC_avgmatrix.mat", "DTIrsEEG")
+            stack = np.stack([np.asarray(subject[field]) for subject in subjects[0]])
+            return stack, {"axes": ["subject", "region", "region"]}
+
+        return loader
+
+    def fibers(filename, header):
+        def loader():
+            # mean80_fiberlength.csv has no header, its rows follow fibercount
+            _, counts = _matrix_csv("connectivity_matrices/mean80_fibercount.csv")
+            matrix, _ = _matrix_csv(filename, header=header)
+            return matrix, {"regions": list(counts.columns)}
+
+        return filename, loader
+
+    def region_csv(filename):
+        def loader():
+            matrix, table = _matrix_csv(filename, index_col=0)
+            return matrix, {"rows": list(table.index), "columns": list(table.columns)}
+
+        return filename, loader
+
+    def dk_centroids():
+        matrix, table = _matrix_csv("atlases/DK/dk_centroids.csv", index_col=0)
+        return matrix, {"regions": list(table.index), "columns": list(table.columns)}
+
+    def aal_volume():
+        import nibabel
+
+        img = nibabel.load(_data_path("atlases/AAL/aal.nii.gz"))
+        return np.asarray(img.dataobj), {"affine": img.affine.tolist()}
+
+    return {
+        "dk_connectivity": mat_matrix(
+            "connectivity_matrices/dk_connectivity.mat", "meanACS", connectivity_regions
+        ),
+        "dk_conn_meanACS69": mat_matrix(
+            "connectivity_matrices/dk_conn_meanACS69.mat", "meanACS"
+        ),
+        "aux_meanACS69": mat_matrix(
+            "connectivity_matrices/aux_meanACS69.mat", "meanACS"
+        ),
+        "dk_ADNI_averaged": mat_matrix(
+            "connectivity_matrices/dk_ADNI_averaged.mat", "connectome_avg"
+        ),
+        "laplacians": ("connectivity_matrices/laplacians.mat", laplacians),
+        "AAL_connectivity": (
+            "connectivity_matrices/AAL_connectivity.mat",
+            aal_connectivity,
+        ),
+        "rsEEG_MapTFC": (
+            "connectivity_matrices/rsEEG_TFC_avgmatrix.mat",
+            rs_eeg("MapTFC"),
+        ),
+        "rsEEG_distance": (
+            "connectivity_matrices/rsEEG_TFC_avgmatrix.mat",
+            rs_eeg("distance"),
+        ),
+        "mean80_fibercount": fibers(
+            "connectivity_matrices/mean80_fibercount.csv", "infer"
+        ),
+        "mean80_fiberlength": fibers(
+            "connectivity_matrices/mean80_fiberlength.csv", None
+        ),
+        "ADNI37_conn_fs_order": region_csv("postprocessing/ADNI37_conn_fs_order.csv"),
+        "mean80_conn_fs_order": region_csv("postprocessing/mean80_conn_fs_order.csv"),
+        "meanACS69_conn_fs_order": region_csv(
+            "postprocessing/meanACS69_conn_fs_order.csv"
+        ),
+        "AAL_dictionary_counts": region_csv("atlases/AAL/AAL_dictionary_counts.csv"),
+        "AAL_dictionary_normalized": region_csv(
+            "atlases/AAL/AAL_dictionary_normalized.csv"
+        ),
+        "dk_centroids": ("atlases/DK/dk_centroids.csv", dk_centroids),
+        "weighU": ("weighU.npy", lambda: (np.load(_data_path("weighU.npy")), {})),
+        "aal": ("atlases/AAL/aal.nii.gz", aal_volume),
+    }
+
+
+def build_store(store_dir=None):
+    """Consolidate the bundled atlases and connectomes into a memory-mappable store.
+
+    Every matrix, stack and volume under ./data/ is written as an
+    uncompressed, C-contiguous .npy file (whose data start is 64-byte
+    aligned), next to a JSON manifest holding region names, DK orderings
+    and per-array metadata. Once built, `atlas_utils` loaders read from the
+    store instead of parsing .mat/.csv files.
+
+    Args:
+        store_dir (str, optional): output directory. Defaults to STORE_DIR.
+
+    Returns:
+        dict: the manifest.
+
+    """
+    from cortography.utils import atlas_utils
+
+    store_dir = STORE_DIR if store_dir is None else store_dir
+    os.makedirs(store_dir, exist_ok=True)
+
+    arrays = {}
+    for name, (source, loader) in _store_sources().items():
+        array, metadata = loader()
+        array = np.ascontiguousarray(array)
+        # never truncated in place: workers may have the old file mapped
+        _save_atomic(os.path.join(store_dir, name + ".npy"), array)
+        metadata.update(
+            {
+                "file": name + ".npy",
+                "source": source,
+                "shape": list(array.shape),
+                "dtype": array.dtype.str,
+            }
+        )
+        arrays[name] = metadata
+
+    orderings = ["all"] + list(atlas_utils.PORTIONS)
+    manifest = {
+        "arrays": arrays,
+        "orderings": {
+            "DK": {
+                portion: list(atlas_utils.load_atlas("DK", portion).index)
+                for portion in orderings
+            }
+        },
+        "connectome_excluded": atlas_utils.CONNECTOME_EXCLUDED,
+    }
+
+    # the manifest goes last: a store without one is never read
+    _write_manifest(store_dir, manifest)
+
+    cache_clear()
+    return manifest
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def load_manifest(store_dir=None):
+    """Manifest of the data store, or None when the store has not been built.
+
+    Args:
+        store_dir (str, optional): store directory. Defaults to STORE_DIR.
+
+    Returns:
+        dict or None: "arrays" metadata, DK "orderings" and
+        "connectome_excluded" regions.
+
+    """
+    store_dir = STORE_DIR if store_dir is None else store_dir
+    manifest_path = os.path.join(store_dir, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def has_array(name, store_dir=None):
+    """Whether array `name` is available in the built data store."""
+    manifest = load_manifest(store_dir)
+    return manifest is not None and name in manifest["arrays"]
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def load_array(name, store_dir=None):
+    """Open a stored array read-only and zero-copy with `np.load(mmap_mode='r')`.
+
+    Pages are shared through the OS page cache by every process mapping
+    the store.
+
+    Args:
+        name (str): array name, a key of `load_manifest()["arrays"]`.
+        store_dir (str, optional): store directory. Defaults to STORE_DIR.
+
+    Returns:
+        np.memmap: the stored array.
+
+    """
+    manifest = load_manifest(store_dir)
+    if manifest is None:
+        raise FileNotFoundError("Data store not built, see store_utils.build_store.")
+    store_dir = STORE_DIR if store_dir is None else store_dir
+    return np.load(
+        os.path.join(store_dir, manifest["arrays"][name]["file"]), mmap_mode="r"
+    )
+
+
+def cache_clear():
+    """Forget opened store manifests and arrays."""
+    load_manifest.cache_clear()
+    load_array.cache_clear()
@@ -0,0 +1,478 @@
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from cortography.utils import atlas_utils, store_utils
+
+# nibabel is imported where it is used (see atlas_utils).
+
+CACHE_SIZE = 32
+
+
+def load_image(img):
+    """Open a volume lazily (data stays on disk behind nibabel's proxy).
+
+    Paths are opened with `keep_file_open=True`, so that successive slices
+    of a .nii.gz proxy continue from one open, decompressing stream instead
+    of decompressing the file again from its start for every slice.
+
+    Args:
+        img (str or nibabel image): path, either absolute/relative to the
+            working directory or relative to ./data/ (e.g.
+            "atlases/AAL/aal.nii.gz"), or an already opened image.
+
+    Returns:
+        nibabel image.
+
+    """
+    if not isinstance(img, str):
+        return img
+
+    import nibabel
+
+    if not os.path.exists(img):
+        img = atlas_utils.get_file_path(img)
+    return nibabel.load(img, keep_file_open=True)
+
+
+def _build_voxel_index(img, labels):
+    img = load_image(img)
+    data = atlas_utils._read_slab(img)
+    values = atlas_utils._label_values(labels, img, True, img.shape[0])
+
+    # Fortran order: the on-disk NIfTI layout, so painted volumes are written
+    # without transposing
+    flat = data.ravel(order="F")
+    voxels = np.flatnonzero(np.isin(flat, values))
+    regions = np.searchsorted(values, flat[voxels])
+
+    for array in (voxels, regions, values):
+        array.flags.writeable = False
+    return voxels, regions, values, data.shape, img.affine
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _cached_voxel_index(filename, values):
+    return _build_voxel_index(
+        filename, None if values is None else dict.fromkeys(values)
+    )
+
+
+def label_voxel_index(label_img, labels=None):
+    """Precompute which voxels belong to which region of a label volume.
+
+    Indexes of bundled or on-disk atlases (given by path) are cached.
+
+    Args:
+        label_img (str or nibabel image): label volume, e.g.
+            "atlases/AAL/aal.nii.gz".
+        labels (dict or list, optional): label value -> region name (or
+            list, position = value), as in `atlas_utils.compute_overlap`.
+            Defaults to every non-zero label in the volume.
+
+    Returns:
+        voxels (np.ndarray): flat (Fortran order) indices of labeled voxels.
+        regions (np.ndarray): region (column) index of each of these voxels.
+        values (np.ndarray): sorted label value of each region.
+        shape (tuple): 3D shape of the volume.
+        affine (np.ndarray): voxel to world transform.
+
+    """
+    if not isinstance(label_img, str):
+        return _build_voxel_index(label_img, labels)
+    if labels is not None:
+        keys = labels if isinstance(labels, dict) else range(len(labels))
+        labels = tuple(sorted(keys))
+    return _cached_voxel_index(label_img, labels)
+
+
+def _region_columns(data, labels, values):
+    """(subjects x regions) array with columns in `values` order."""
+    if isinstance(data, pd.DataFrame):
+        names = atlas_utils._label_names(labels, values)
+        data = data.reindex(columns=names).values
+    data = np.asarray(data)
+    if data.shape[-1] != len(values):
+        raise ValueError(
+            "Expected {} regions, got {}.".format(len(values), data.shape[-1])
+        )
+    return data
+
+
+def _paint(row, voxels, regions, num_voxels, fill, dtype):
+    volume = np.full(num_voxels, fill, dtype=dtype)
+    volume[voxels] = row[regions]
+    return volume
+
+
+def paint_regions(label_img, data, labels=None, fill=0, dtype=np.float32):
+    """Map region-wise values back to voxels of an atlas.
+
+    Each subject is a single gather through the precomputed
+    `label_voxel_index`.
+
+    Args:
+        label_img (str or nibabel image): label volume.
+        data (np.ndarray or pd.DataFrame): (R,) or (subjects x R) values, in
+            the order of the sorted label values (DataFrame columns are
+            matched to the region names of `labels`).
+        labels (dict or list, optional): see `label_voxel_index`.
+        fill (float): value of unlabeled voxels.
+        dtype: output dtype.
+
+    Returns:
+        np.ndarray: (X, Y, Z) volume, or (X, Y, Z, subjects) volumes.
+
+    """
+    voxels, regions, values, shape, _ = label_voxel_index(label_img, labels)
+    data = _region_columns(data, labels, values)
+    rows = data.reshape(-1, len(values))
+    num_voxels = int(np.prod(shape))
+
+    volumes = np.empty((num_voxels, len(rows)), dtype=dtype, order="F")
+    for subject, row in enumerate(rows):
+        volumes[:, subject] = _paint(row, voxels, regions, num_voxels, fill, dtype)
+    volumes = volumes.reshape(shape + (len(rows),), order="F")
+
+    return volumes[..., 0] if data.ndim == 1 else volumes
+
+
+def write_painted_nifti(
+    label_img, data, filename, labels=None, fill=0, dtype=np.float32
+):
+    """Paint region-wise values of many subjects into a 4D NIfTI file.
+
+    Volumes are painted and written one subject at a time, so memory stays
+    at one volume however many subjects (e.g. a memory-mapped (N, R)
+    array) are written.
+
+    Args:
+        label_img (str or nibabel image): label volume, whose grid and affine
+            the output uses.
+        data (np.ndarray or pd.DataFrame): (R,) or (subjects x R) values, see
+            `paint_regions`.
+        filename (str): output .nii or .nii.gz file.
+        labels (dict or list, optional): see `label_voxel_index`.
+        fill (float): value of unlabeled voxels.
+        dtype: stored dtype, e.g. np.float32 or np.int16. Integer outputs are
+            scaled to their full range through the header's scl_slope.
+
+    Returns:
+        str: `filename`.
+
+    """
+    import nibabel
+
+    voxels, regions, values, shape, affine = label_voxel_index(label_img, labels)
+    data = _region_columns(data, labels, values)
+    rows = data.reshape(-1, len(values))
+    num_voxels = int(np.prod(shape))
+    dtype = np.dtype(dtype)
+
+    header = nibabel.Nifti1Header()
+    header.set_data_shape(shape if data.ndim == 1 else shape + (len(rows),))
+    header.set_data_dtype(dtype)
+    header.set_qform(affine, code=1)
+    header.set_sform(affine, code=1)
+    header.set_xyzt_units("mm")
+
+    integer = np.issubdtype(dtype, np.integer)
+    if integer:
+        largest = max(np.nanmax(np.abs(rows)), abs(fill))
+        slope = float(largest) / np.iinfo(dtype).max if largest > 0 else 1.0
+        header.set_slope_inter(slope, 0.0)
+    header.set_data_offset(352)
+
+    with nibabel.openers.ImageOpener(filename, "wb") as f:
+        header.write_to(f)
+        f.write(b"\x00" * (header.get_data_offset() - f.tell()))
+        for row in rows:
+            if integer:
+                volume = _paint(row, voxels, regions, num_voxels, fill, float)
+                volume = np.round(np.nan_to_num(volume / slope))
+            else:
+                volume = _paint(row, voxels, regions, num_voxels, fill, dtype)
+            f.write(volume.astype(dtype, copy=False).tobytes())
+
+    return filename
+
+
+def _grid_regions(label_img, labels, shape, affine):
+    """Region index of every voxel of a (shape, affine) grid, by nearest
+    neighbour lookup in the label volume (-1 outside any region)."""
+    voxels, regions, values, label_shape, label_affine = label_voxel_index(
+        label_img, labels
+    )
+    grid_regions = np.full(int(np.prod(label_shape)), -1)
+    grid_regions[voxels] = regions
+    if tuple(shape) == tuple(label_shape) and np.allclose(affine, label_affine):
+        return grid_regions, values
+
+    grid_regions = grid_regions.reshape(label_shape, order="F")
+    transform = np.linalg.solve(label_affine, affine)
+    ijk = np.indices(shape).reshape(3, -1, order="F")
+    label_ijk = np.round(transform[:3, :3].dot(ijk) + transform[:3, 3:]).astype(int)
+    inside = np.all(
+        (label_ijk >= 0) & (label_ijk < np.array(label_shape)[:, None]), axis=0
+    )
+    mapped = np.full(ijk.shape[1], -1)
+    mapped[inside] = grid_regions[tuple(label_ijk[:, inside])]
+    return mapped, values
+
+
+def _build_parcel_operator(label_img, labels, shape, affine):
+    grid_regions, values = _grid_regions(label_img, labels, shape, affine)
+    voxels = np.flatnonzero(grid_regions >= 0)
+    regions = grid_regions[voxels]
+    sizes = np.bincount(regions, minlength=len(values))
+    weights = 1.0 / np.maximum(sizes, 1)
+
+    operator = sparse.csr_matrix(
+        (weights[regions].astype(np.float32), (regions, voxels)),
+        shape=(len(values), int(np.prod(shape))),
+    )
+    return operator, values
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _cached_parcel_operator(filename, values, shape, affine):
+    labels = None if values is None else dict.fromkeys(values)
+    return _build_parcel_operator(
+        filename, labels, shape, np.array(affine).reshape(4, 4)
+    )
+
+
+def parcel_operator(label_img, shape, affine, labels=None):
+    """Sparse region-averaging operator of an atlas on a voxel grid.
+
+    Voxels of the grid take the label of the nearest atlas voxel, so the
+    atlas does not need to be resampled to the data beforehand. Operators of
+    atlases given by path are cached per grid.
+
+    Args:
+        label_img (str or nibabel image): label volume, e.g.
+            "atlases/AAL/aal.nii.gz".
+        shape (tuple): 3D shape of the data grid.
+        affine (np.ndarray): voxel to world transform of the data grid.
+        labels (dict or list, optional): see `label_voxel_index`.
+
+    Returns:
+        operator (scipy.sparse.csr_matrix): (R, X*Y*Z) float32 weights, such
+            that `operator @ volume.ravel(order="F")` gives the region means.
+        values (np.ndarray): label value of each region (row).
+
+    """
+    shape = tuple(int(n) for n in shape[:3])
+    affine = np.asarray(affine, dtype=float)
+    if not isinstance(label_img, str):
+        return _build_parcel_operator(label_img, labels, shape, affine)
+    if labels is not None:
+        keys = labels if isinstance(labels, dict) else range(len(labels))
+        labels = tuple(sorted(keys))
+    return _cached_parcel_operator(
+        label_img, labels, shape, tuple(affine.ravel().tolist())
+    )
+
+
+def extract_timeseries(img, label_img, labels=None, chunk_size=50):
+    """Region-mean time series of a 4D image, streamed in time chunks.
+
+    The image is read `chunk_size` volumes at a time through nibabel's
+    proxy and averaged with one sparse product per chunk (see
+    `parcel_operator`), so memory is bounded by the chunk rather than the
+    whole acquisition. Uncompressed .nii files are read fastest. A .nii.gz
+    file is decompressed once, front to back, only if it stays open between
+    chunks: paths are opened that way by `load_image`, already opened
+    images should be loaded with `nibabel.load(path, keep_file_open=True)`
+    (otherwise every chunk decompresses the file again from its start).
+
+    Args:
+        img (str or nibabel image): 4D (X, Y, Z, T) image, e.g. rsfMRI. A
+            3D image is a single volume (T = 1).
+        label_img (str or nibabel image): atlas label volume, e.g.
+            "atlases/AAL/aal.nii.gz" (see `load_image`).
+        labels (dict or list, optional): see `label_voxel_index`.
+        chunk_size (int): number of volumes read at once.
+
+    Returns:
+        np.ndarray: (T, R) float32 region means, one column per label value
+        in ascending order (as `parcel_operator` returns them).
+
+    """
+    img = load_image(img)
+    operator, values = parcel_operator(label_img, img.shape, img.affine, labels)
+    num_voxels = operator.shape[1]
+    num_volumes = img.shape[3] if len(img.shape) > 3 else 1
+
+    timeseries = np.empty((num_volumes, len(values)), dtype=np.float32)
+    for start in range(0, num_volumes, chunk_size):
+        stop = min(start + chunk_size, num_volumes)
+        if len(img.shape) > 3:
+            block = img.dataobj[..., start:stop]
+        else:
+            block = img.dataobj[...]
+        block = np.asarray(block, dtype=np.float32)
+        block = block.reshape(num_voxels, -1, order="F")
+        timeseries[start:stop] = operator.dot(block).T
+
+    return timeseries
+
+
+def _build_region_geometry(label_img, labels):
+    """Voxel counts, centers of mass, medoids and bounding boxes (world
+    coordinates) of every region, from one pass over the labeled voxels."""
+    voxels, regions, values, shape, affine = label_voxel_index(label_img, labels)
+    ijk = np.array(np.unravel_index(voxels, shape, order="F"), dtype=float)
+    counts = np.bincount(regions, minlength=len(values))
+
+    # center of mass: mean voxel position, mapped with the (linear) affine
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_ijk = (
+            np.array(
+                [
+                    np.bincount(regions, weights=axis, minlength=len(values))
+                    for axis in ijk
+                ]
+            )
+            / counts
+        )
+    centroids = (affine[:3, :3].dot(mean_ijk) + affine[:3, 3:]).T
+
+    # regions as contiguous runs of voxels
+    order = np.argsort(regions, kind="stable")
+    starts = np.searchsorted(regions[order], np.arange(len(values)))
+    present = counts > 0
+    xyz = affine[:3, :3].dot(ijk[:, order]) + affine[:3, 3:]
+
+    # medoid: the region voxel closest to its center of mass
+    distances = ((xyz - centroids[regions[order]].T) ** 2).sum(axis=0)
+    nearest = np.lexsort((distances, regions[order]))
+    medoids = np.full((len(values), 3), np.nan)
+    medoids[present] = xyz[:, nearest[starts[present]]].T
+
+    boxes = np.full((len(values), 6), np.nan)
+    boxes[present, :3] = np.minimum.reduceat(xyz, starts[present], axis=1).T
+    boxes[present, 3:] = np.maximum.reduceat(xyz, starts[present], axis=1).T
+
+    geometry = {
+        "values": values,
+        "counts": counts,
+        "center_of_mass": centroids,
+        "medoid": medoids,
+        "bounding_box": boxes,
+    }
+    for array in geometry.values():
+        array.flags.writeable = False
+    return geometry
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _cached_region_geometry(filename, values):
+    return _build_region_geometry(
+        filename, None if values is None else dict.fromkeys(values)
+    )
+
+
+def _region_geometry(label_img, labels):
+    if not isinstance(label_img, str):
+        return _build_region_geometry(label_img, labels)
+    keys = None
+    if labels is not None:
+        keys = labels if isinstance(labels, dict) else range(len(labels))
+        keys = tuple(sorted(keys))
+    return _cached_region_geometry(label_img, keys)
+
+
+def region_centroids(label_img, labels=None, method="center_of_mass"):
+    """World (e.g. MNI) coordinates of every region of a label volume.
+
+    All regions are computed at once with `np.bincount` over the labeled
+    voxels, and cached for atlases given by path.
+
+    Args:
+        label_img (str or nibabel image): label volume, e.g.
+            "atlases/AAL/aal.nii.gz".
+        labels (dict or list, optional): see `label_voxel_index`; its names
+            index the result (label values otherwise).
+        method (str): "center_of_mass" or "medoid" (the region voxel
+            closest to the center of mass, always inside the region).
+
+    Returns:
+        pd.DataFrame: (R, 3) float "x", "y", "z" coordinates, NaN for
+        labels without voxels.
+
+    """
+    geometry = _region_geometry(label_img, labels)
+    return pd.DataFrame(
+        geometry[method],
+        index=atlas_utils._label_names(labels, geometry["values"]),
+        columns=["x", "y", "z"],
+    )
+
+
+def region_bounding_boxes(label_img, labels=None):
+    """Bounding boxes (world coordinates of the extreme voxel centers) of
+    every region of a label volume.
+
+    Args:
+        label_img, labels: see `region_centroids`.
+
+    Returns:
+        pd.DataFrame: (R, 6) float "x_min", "y_min", "z_min", "x_max",
+        "y_max", "z_max".
+
+    """
+    geometry = _region_geometry(label_img, labels)
+    return pd.DataFrame(
+        geometry["bounding_box"],
+        index=atlas_utils._label_names(labels, geometry["values"]),
+        columns=["x_min", "y_min", "z_min", "x_max", "y_max", "z_max"],
+    )
+
+
+def load_centroids(atlas="DK"):
+    """Region coordinates of a bundled atlas.
+
+    Args:
+        atlas (str): "DK" (centers of mass of the FreeSurfer Desikan-Killiany
+            volume, see scripts/dk_centroids.py, also indexed by the
+            connectome names of atlas_utils.CONNECTOME_ALIASES) or "AAL"
+            (computed from the bundled aal.nii.gz, indexed by label value).
+
+    Returns:
+        pd.DataFrame: (R, 3) float "x", "y", "z" MNI coordinates.
+
+    """
+    if atlas == "DK":
+        if store_utils.has_array("dk_centroids"):
+            metadata = store_utils.load_manifest()["arrays"]["dk_centroids"]
+            # small, and copied anyway by the concat of the aliases below
+            centroids = pd.DataFrame(
+                store_utils.load_array("dk_centroids"),
+                index=pd.Index(metadata["regions"], name="Name"),
+                columns=metadata["columns"],
+            )
+        else:
+            centroids = atlas_utils._read_csv("atlases/DK/dk_centroids.csv")
+            centroids = centroids.set_index("Name")
+        # so that load_centroids().loc[load_connectivity().index] works
+        aliases = {
+            name: alias
+            for name, alias in atlas_utils.CONNECTOME_ALIASES.items()
+            if name in centroids.index and alias not in centroids.index
+        }
+        aliased = centroids.loc[list(aliases)].rename(index=aliases)
+        return pd.concat([centroids, aliased])
+    if atlas == "AAL":
+        return region_centroids("atlases/AAL/aal.nii.gz")
+    raise NameError("Atlas option not found.")
+
+
+def cache_clear():
+    """Forget cached voxel indexes, parcel operators and region geometry."""
+    _cached_voxel_index.cache_clear()
+    _cached_parcel_operator.cache_clear()
+    _cached_region_geometry.cache_clear()
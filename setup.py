@@ -1,3 +1,4 @@
+import setuptools
 from setuptools import setup
 
 setup(name='cortography',
@@ -10,6 +11,6 @@ setup(name='cortography',
       packages = setuptools.find_packages(),
       include_package_data = True,
       package_data = {
-            '': ['*.txt', '*.xml', '*.csv', '*.md','*.nii','*.nii.gz','*.npy'],
+            '': ['*.txt', '*.xml', '*.csv', '*.md','*.nii','*.nii.gz','*.npy','*.json'],
       },
       zip_safe=False)
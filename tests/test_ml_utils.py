@@ -0,0 +1,24 @@
+import numpy as np
+
+from cortography.utils import ml_utils
+
+
+def test_relabel_clusters_more_clusters_than_classes():
+    # 4 clusters x 3 classes: the padded phantom class is cropped away
+    contingency = np.array([[5, 14, 14], [12, 2, 12], [1, 1, 24], [3, 0, 0]])
+    result = ml_utils.relabel_clusters(contingency)
+
+    np.testing.assert_array_equal(result["assignment"], [1, 0, 2])
+    np.testing.assert_array_equal(
+        result["confusion_matrix"], [[12, 5, 1], [2, 14, 1], [12, 14, 24]]
+    )
+    assert np.isclose(result["accuracy"], 50 / 88)
+
+
+def test_make_cm_from_group_dist_more_clusters_than_classes():
+    group_dist = {
+        "tau": {"c0": [5, 14, 14], "c1": [12, 2, 12], "c2": [1, 1, 24], "c3": [3, 0, 0]}
+    }
+    cms = ml_utils.make_cm_from_group_dist(group_dist, num_classes=3)
+
+    assert cms["tau"].shape == (3, 3)